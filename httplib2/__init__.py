@@ -30,8 +30,6 @@ import email
 import email.Utils
 import email.Message
 import email.FeedParser
-import StringIO
-import gzip
 import zlib
 import httplib
 import urlparse
@@ -52,12 +50,24 @@ except ImportError:
 import hmac
 from gettext import gettext as _
 import socket
+import tempfile
+import threading
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
 
 try:
     import socks
 except ImportError:
     socks = None
 
+try:
+    import select
+except ImportError:
+    select = None
+
 # Build the appropriate socket wrapper for ssl
 try:
     import ssl # python 2.6
@@ -79,7 +89,8 @@ def has_timeout(timeout): # python 2.6
         return (timeout is not None and timeout is not socket._GLOBAL_DEFAULT_TIMEOUT)
     return (timeout is not None)
 
-__all__ = ['Http', 'Response', 'ProxyInfo', 'HttpLib2Error',
+__all__ = ['Http', 'Response', 'ResponseStream', 'ProxyInfo', 'ConnectionPool', 'FileCache',
+  'MemoryCache', 'BoundedFileCache', 'HttpLib2Error',
   'RedirectMissingLocation', 'RedirectLimit', 'FailedToDecompressContent', 
   'UnimplementedDigestAuthOptionError', 'UnimplementedHmacDigestAuthOptionError',
   'debuglevel']
@@ -147,6 +158,15 @@ class ServerNotFoundError(HttpLib2Error): pass
 # requesting that URI again.
 DEFAULT_MAX_REDIRECTS = 5
 
+# The most connections kept open to one host, and how long, in seconds,
+# an unused connection is kept before it is closed.
+DEFAULT_MAX_CONNECTIONS = 4
+DEFAULT_IDLE_TIMEOUT = 60
+
+# Default size limits, in bytes, of MemoryCache and BoundedFileCache
+DEFAULT_MEMORY_CACHE_BYTES = 10 * 1024 * 1024
+DEFAULT_FILE_CACHE_BYTES = 100 * 1024 * 1024
+
 # Which headers are hop-by-hop headers by default
 HOP_BY_HOP = ['connection', 'keep-alive', 'proxy-authenticate', 'proxy-authorization', 'te', 'trailers', 'transfer-encoding', 'upgrade']
 
@@ -340,30 +360,165 @@ def _entry_disposition(response_headers, request_headers):
             retval = "FRESH"
     return retval 
 
-def _decompressContent(response, new_content):
-    content = new_content
+# Compressed bodies are read from the socket and inflated this many bytes at a time
+DECOMPRESS_CHUNK_SIZE = 16 * 1024
+
+def _decompressor(response):
+    """Return a zlib decompressor for a gzip or deflate response, or None."""
+    encoding = response.get('content-encoding', None)
+    if encoding == 'gzip':
+        # 16 + MAX_WBITS makes zlib expect a gzip header and trailer
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    elif encoding == 'deflate':
+        return zlib.decompressobj()
+    return None
+
+def _decompressContent(response, http_response):
+    """Read the body of http_response, inflating a gzip or deflate
+    body chunk by chunk as it arrives rather than reading it whole first."""
+    decompressor = _decompressor(response)
+    if decompressor is None:
+        return http_response.read()
     try:
-        encoding = response.get('content-encoding', None)
-        if encoding in ['gzip', 'deflate']:
-            if encoding == 'gzip':
-                content = gzip.GzipFile(fileobj=StringIO.StringIO(new_content)).read()
-            if encoding == 'deflate':
-                content = zlib.decompress(content)
-            response['content-length'] = str(len(content))
-            # Record the historical presence of the encoding in a way the won't interfere.
-            response['-content-encoding'] = response['content-encoding']
-            del response['content-encoding']
-    except IOError:
+        chunks = []
+        while True:
+            chunk = http_response.read(DECOMPRESS_CHUNK_SIZE)
+            if not chunk:
+                break
+            chunks.append(decompressor.decompress(chunk))
+        chunks.append(decompressor.flush())
+        content = "".join(chunks)
+        response['content-length'] = str(len(content))
+        # Record the historical presence of the encoding in a way the won't interfere.
+        response['-content-encoding'] = response['content-encoding']
+        del response['content-encoding']
+    except (IOError, zlib.error):
         content = ""
         raise FailedToDecompressContent(_("Content purported to be compressed with %s but failed to decompress.") % response.get('content-encoding'), response, content)
     return content
 
+class ResponseStream(object):
+    """The body of a response to Http.request(stream=True): an iterator
+    of decompressed chunks, read from the socket DECOMPRESS_CHUNK_SIZE
+    bytes at a time.  Iterate it to the end, or close() it, to give the
+    connection back.
+    """
+    def __init__(self, response, http_response=None, content=None):
+        self.response = response
+        self._http_response = http_response
+        self._decompressor = None
+        self._chunks = content and [content] or []
+        self._tee = None
+        self._on_close = []
+        # Set once the connection it is read from is tied to it
+        self._pooled = False
+        if http_response is not None:
+            self._decompressor = _decompressor(response)
+            if self._decompressor is not None:
+                # Record the historical presence of the encoding in a way the won't interfere.
+                response['-content-encoding'] = response['content-encoding']
+                del response['content-encoding']
+                if 'content-length' in response:
+                    del response['content-length']
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        if self._chunks:
+            return self._chunks.pop(0)
+        while self._http_response is not None:
+            # Inflate at most a chunk at a time, keeping the rest of the
+            # compressed data read for the next call
+            if self._decompressor is not None and self._decompressor.unconsumed_tail:
+                data = self._decompressor.unconsumed_tail
+            else:
+                try:
+                    data = self._http_response.read(DECOMPRESS_CHUNK_SIZE)
+                except:
+                    self._close(False)
+                    raise
+            chunk = data
+            if self._decompressor is not None:
+                try:
+                    if data:
+                        chunk = self._decompressor.decompress(data, DECOMPRESS_CHUNK_SIZE)
+                    else:
+                        chunk = self._decompressor.flush()
+                except zlib.error:
+                    self._close(False)
+                    raise FailedToDecompressContent(_("Content purported to be compressed with %s but failed to decompress.") % self.response.get('-content-encoding'), self.response, "")
+            if self._tee is not None and chunk:
+                self._tee[2] += len(chunk)
+                if self._tee[1] is not None and self._tee[2] > self._tee[1]:
+                    self._tee = None
+                else:
+                    self._tee[3].append(chunk)
+            if not data:
+                self._close(True)
+            if chunk:
+                return chunk
+        raise StopIteration
+
+    def read(self):
+        """Return the rest of the body as one string."""
+        return "".join(list(self))
+
+    def close(self):
+        """Stop reading the body, dropping the connection if some of it
+        is still unread."""
+        self._chunks = []
+        self._close(False)
+
+    def tee(self, callback, limit=None):
+        """Call callback(content) with the whole body once it has been
+        read to the end, unless it turns out longer than limit bytes."""
+        self._tee = [callback, limit, 0, []]
+
+    def on_close(self, callback):
+        """Call callback(complete) once the body has been read to the end,
+        complete is True, or closed early, complete is False."""
+        if self._http_response is None:
+            callback(True)
+        else:
+            self._on_close.append(callback)
+
+    def _close(self, complete):
+        if self._http_response is None:
+            return
+        self._http_response.close()
+        self._http_response = None
+        if complete and self._tee is not None:
+            self._tee[0]("".join(self._tee[3]))
+        self._tee = None
+        callbacks, self._on_close = self._on_close, []
+        for callback in callbacks:
+            callback(complete)
+
 def _updateCache(request_headers, response_headers, content, cache, cachekey):
     if cachekey:
         cc = _parse_cache_control(request_headers)
         cc_response = _parse_cache_control(response_headers)
         if cc.has_key('no-store') or cc_response.has_key('no-store'):
             cache.delete(cachekey)
+        elif getattr(cache, 'parsed_entries', False):
+            # The cache keeps the headers as a dict rather than as text
+            # that has to be parsed again on every hit
+            info = {}
+            for key, value in response_headers.iteritems():
+                if key not in ['status','content-encoding','transfer-encoding']:
+                    info[key] = value
+            vary = response_headers.get('vary', None)
+            if vary:
+                vary_headers = vary.lower().replace(' ', '').split(',')
+                for header in vary_headers:
+                    if header in request_headers:
+                        info['-varied-%s' % header] = request_headers[header]
+            status = response_headers.status
+            if status == 304:
+                status = 200
+            info['status'] = str(status)
+            cache.set(cachekey, (info, content))
         else:
             info = email.Message.Message()
             for key, value in response_headers.iteritems():
@@ -412,9 +567,15 @@ def _wsse_username_token(cnonce, iso_now, password):
 # how close to the 'top' it is.
 
 class Authentication(object):
+    # The scheme and realm of the challenge answered, set by Http
+    scheme = None
+    realm = None
+
     def __init__(self, credentials, host, request_uri, headers, response, content, http):
         (scheme, authority, path, query, fragment) = parse_uri(request_uri)
-        self.path = path
+        # RFC 2617 section 2: all paths at or deeper than the last symbolic
+        # element of the challenged path share its protection space
+        self.path = path[:path.rfind("/") + 1] or "/"
         self.host = host
         self.credentials = credentials
         self.http = http
@@ -445,6 +606,49 @@ class Authentication(object):
 
 
 
+class _AuthorizationIndex(object):
+    """The authorizations learned from challenges, by host, deepest
+    protection space first.  Finding the one to apply to a request is a
+    dict lookup and a scan of the spaces of that host, and a space added
+    for a realm already known to the host shares the newest authorization
+    for it, so its nonces and counters stay current everywhere.
+    """
+    def __init__(self):
+        # host -> [(path, authorization)], longest path first
+        self._by_host = {}
+
+    def find(self, host, request_uri):
+        spaces = self._by_host.get(host)
+        if spaces:
+            path = parse_uri(request_uri)[2]
+            for space, auth in spaces:
+                if path.startswith(space):
+                    return auth
+        return None
+
+    def add(self, authorization):
+        spaces = []
+        for space, auth in self._by_host.get(authorization.host, []):
+            if space == authorization.path:
+                continue
+            if authorization.realm is not None and \
+                    (auth.scheme, auth.realm) == (authorization.scheme, authorization.realm):
+                auth = authorization
+            spaces.append((space, auth))
+        spaces.append((authorization.path, authorization))
+        spaces.sort(key=lambda space: -len(space[0]))
+        # Replaced rather than changed in place, threads may be reading it
+        self._by_host[authorization.host] = spaces
+
+    def __iter__(self):
+        seen = []
+        for spaces in self._by_host.values():
+            for space, auth in spaces:
+                if auth not in seen:
+                    seen.append(auth)
+        return iter(seen)
+
+
 class BasicAuthentication(Authentication):
     def __init__(self, credentials, host, request_uri, headers, response, content, http):
         Authentication.__init__(self, credentials, host, request_uri, headers, response, content, http)
@@ -670,6 +874,184 @@ class FileCache(object):
         if os.path.exists(cacheFullPath):
             os.remove(cacheFullPath)
 
+def _entry_size(value):
+    if isinstance(value, tuple):
+        info, content = value
+        return len(content) + sum([len(k) + len(v) for k, v in info.iteritems()])
+    return len(value)
+
+
+class MemoryCache(object):
+    """An in memory cache that drops the least recently used entries once
+    they hold more than 'max_bytes'.  Entries are kept parsed, so a hit is
+    a dict lookup.  Safe to share between threads.
+    """
+    parsed_entries = True
+
+    def __init__(self, max_bytes=DEFAULT_MEMORY_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # key -> [previous, next, key, value, size] links of a circular
+        # list running from the least to the most recently used entry
+        self._entries = {}
+        self._root = []
+        self._root[:] = [self._root, self._root, None, None, 0]
+        self._bytes = 0
+
+    def get(self, key):
+        self._lock.acquire()
+        try:
+            link = self._entries.get(key)
+            if link is None:
+                return None
+            link[0][1], link[1][0] = link[1], link[0]
+            self._append(link)
+            return link[3]
+        finally:
+            self._lock.release()
+
+    def set(self, key, value):
+        size = _entry_size(value)
+        self._lock.acquire()
+        try:
+            self._remove(key)
+            if size > self.max_bytes:
+                return
+            link = [None, None, key, value, size]
+            self._append(link)
+            self._entries[key] = link
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                self._remove(self._root[1][2])
+        finally:
+            self._lock.release()
+
+    def delete(self, key):
+        self._lock.acquire()
+        try:
+            self._remove(key)
+        finally:
+            self._lock.release()
+
+    def _append(self, link):
+        last = self._root[0]
+        link[0], link[1] = last, self._root
+        last[1] = self._root[0] = link
+
+    def _remove(self, key):
+        link = self._entries.pop(key, None)
+        if link is not None:
+            link[0][1], link[1][0] = link[1], link[0]
+            self._bytes -= link[4]
+
+
+class BoundedFileCache(object):
+    """Uses a local directory as a cache of at most 'max_bytes', that
+    several threads and processes can share.  Entries are pickled parsed
+    and written to a temporary file that is then renamed into place, so a
+    reader never sees half an entry.  Once the directory grows past
+    max_bytes the least recently used entries are removed.
+    """
+    parsed_entries = True
+
+    def __init__(self, cache, max_bytes=DEFAULT_FILE_CACHE_BYTES, safe=safename):
+        self.cache = cache
+        self.max_bytes = max_bytes
+        self.safe = safe
+        if not os.path.exists(cache):
+            try:
+                os.makedirs(self.cache)
+            except OSError:
+                # Another process made it first
+                if not os.path.isdir(self.cache):
+                    raise
+        self._lock = threading.Lock()
+        # Bytes written by this process since the directory was last
+        # measured, None until it has been measured once
+        self._bytes = None
+
+    def get(self, key):
+        cacheFullPath = os.path.join(self.cache, self.safe(key))
+        try:
+            f = file(cacheFullPath, "rb")
+            try:
+                value = pickle.load(f)
+            finally:
+                f.close()
+        except (IOError, EOFError, ValueError, pickle.UnpicklingError):
+            return None
+        # The modification time orders the entries for eviction
+        try:
+            os.utime(cacheFullPath, None)
+        except OSError:
+            pass
+        return value
+
+    def set(self, key, value):
+        cacheFullPath = os.path.join(self.cache, self.safe(key))
+        data = pickle.dumps(value, 2)
+        fd, tmpPath = tempfile.mkstemp(prefix='.tmp', dir=self.cache)
+        try:
+            try:
+                os.write(fd, data)
+            finally:
+                os.close(fd)
+            try:
+                os.rename(tmpPath, cacheFullPath)
+            except OSError:
+                # Windows will not rename over an existing file
+                if os.path.exists(cacheFullPath):
+                    os.remove(cacheFullPath)
+                os.rename(tmpPath, cacheFullPath)
+        except:
+            if os.path.exists(tmpPath):
+                os.remove(tmpPath)
+            raise
+
+        self._lock.acquire()
+        try:
+            if self._bytes is not None:
+                self._bytes += len(data)
+            if self._bytes is None or self._bytes > self.max_bytes:
+                self._trim()
+        finally:
+            self._lock.release()
+
+    def delete(self, key):
+        cacheFullPath = os.path.join(self.cache, self.safe(key))
+        try:
+            os.remove(cacheFullPath)
+        except OSError:
+            pass
+
+    def _trim(self):
+        # Measure the directory, then remove the least recently used
+        # entries until it is back under nine tenths of max_bytes, so the
+        # next few writes don't have to measure it again.
+        entries = []
+        total = 0
+        for name in os.listdir(self.cache):
+            if name.startswith('.tmp'):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.cache, name))
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+            total += stat.st_size
+        if total > self.max_bytes:
+            entries.sort()
+            for mtime, size, name in entries:
+                if total <= self.max_bytes * 9 / 10:
+                    break
+                try:
+                    os.remove(os.path.join(self.cache, name))
+                except OSError:
+                    pass
+                total -= size
+        self._bytes = total
+
+
 class Credentials(object):
     def __init__(self):
         self.credentials = []
@@ -774,6 +1156,112 @@ class HTTPSConnectionWithTimeout(httplib.HTTPSConnection):
         self.sock =_ssl_wrap_socket(sock, self.key_file, self.cert_file)
 
 
+class ConnectionPool(object):
+    """A thread safe pool of keep-alive connections.
+
+Up to 'max_connections' connections are kept per scheme:authority and a
+thread checking out a connection when they are all in use waits for one
+to be checked back in.  A thread that already holds a connection, say
+while following a redirect, never waits on itself though, it gets an
+extra connection that is closed when checked in.  Connections unused
+for 'idle_timeout' seconds are closed, and a connection whose socket
+turned readable while idle, most often because the server closed it, is
+dropped on checkout."""
+    def __init__(self, max_connections=DEFAULT_MAX_CONNECTIONS, idle_timeout=DEFAULT_IDLE_TIMEOUT):
+        self.max_connections = max_connections
+        self.idle_timeout = idle_timeout
+        self._available = threading.Condition(threading.Lock())
+        self._local = threading.local()
+        # conn_key -> [(connection, time it was checked in)], oldest first
+        self._idle = {}
+        # conn_key -> number of open connections, idle or checked out
+        self._open = {}
+
+    def checkout(self, conn_key, connect):
+        """Return a connection for conn_key, calling connect() to make a
+new one when none is idle and the pool is not full."""
+        held = getattr(self._local, 'held', 0)
+        self._available.acquire()
+        try:
+            while True:
+                idle = self._idle.get(conn_key)
+                while idle:
+                    conn, checked_in = idle.pop()
+                    if time.time() - checked_in < self.idle_timeout and self._healthy(conn):
+                        self._local.held = held + 1
+                        return conn
+                    self._close(conn_key, conn)
+                if self._open.get(conn_key, 0) < self.max_connections or held:
+                    self._open[conn_key] = self._open.get(conn_key, 0) + 1
+                    break
+                self._available.wait()
+        finally:
+            self._available.release()
+
+        try:
+            conn = connect()
+        except:
+            self._available.acquire()
+            try:
+                self._open[conn_key] -= 1
+                self._available.notify()
+            finally:
+                self._available.release()
+            raise
+        self._local.held = held + 1
+        return conn
+
+    def checkin(self, conn_key, conn, reusable=True, owned=True):
+        """Give a connection back to the pool.  Connections that are not
+'reusable', such as those that failed in the middle of a request, are
+closed.  Pass owned=False for a connection the thread handed off."""
+        if owned:
+            self.hand_off()
+        self._available.acquire()
+        try:
+            if reusable and self._open[conn_key] <= self.max_connections:
+                self._idle.setdefault(conn_key, []).append((conn, time.time()))
+            else:
+                self._close(conn_key, conn)
+            self._available.notify()
+        finally:
+            self._available.release()
+
+    def hand_off(self):
+        """Stop counting a connection the calling thread checked out as
+held by it, because something else, such as a ResponseStream, will check
+it in later with owned=False, maybe from another thread."""
+        self._local.held = max(getattr(self._local, 'held', 1) - 1, 0)
+
+    def close(self):
+        """Close all the idle connections."""
+        self._available.acquire()
+        try:
+            for conn_key, idle in self._idle.items():
+                for conn, checked_in in idle:
+                    self._close(conn_key, conn)
+            self._idle = {}
+        finally:
+            self._available.release()
+
+    def _close(self, conn_key, conn):
+        self._open[conn_key] -= 1
+        try:
+            conn.close()
+        except (socket.error, httplib.HTTPException):
+            pass
+
+    def _healthy(self, conn):
+        # An idle keep-alive socket has nothing to read, if it does the
+        # server has closed it or sent something unexpected.
+        sock = getattr(conn, 'sock', None)
+        if sock is None or select is None:
+            return True
+        try:
+            return not select.select([sock], [], [], 0)[0]
+        except (select.error, socket.error, ValueError):
+            return False
+
 
 class Http(object):
     """An HTTP client that handles:
@@ -788,15 +1276,21 @@ class Http(object):
 
 and more.
     """
-    def __init__(self, cache=None, timeout=None, proxy_info=None):
+    def __init__(self, cache=None, timeout=None, proxy_info=None, connections=None):
         """The value of proxy_info is a ProxyInfo instance.
 
 If 'cache' is a string then it is used as a directory name
 for a disk cache. Otherwise it must be an object that supports
-the same interface as FileCache."""
+the same interface as FileCache.
+
+The value of 'connections' is the ConnectionPool to take connections
+from, it defaults to a new ConnectionPool.  The pool is thread safe, so
+an Http can be shared by threads as long as its cache is too."""
         self.proxy_info = proxy_info
-        # Map domain name to an httplib connection
-        self.connections = {}
+        # Pool of httplib connections, keyed by scheme:authority
+        if connections is None:
+            connections = ConnectionPool()
+        self.connections = connections
         # The location of the cache, for now a directory
         # where cached responses are held.
         if cache and isinstance(cache, str):
@@ -810,8 +1304,8 @@ the same interface as FileCache."""
         # Key/cert
         self.certificates = KeyCerts()
 
-        # authorization objects
-        self.authorizations = []
+        # authorization objects, indexed by host and path
+        self.authorizations = _AuthorizationIndex()
 
         # If set to False then no redirects are followed, even safe ones.
         self.follow_redirects = True
@@ -838,7 +1332,10 @@ the same interface as FileCache."""
         for cred in self.credentials.iter(host):
             for scheme in AUTH_SCHEME_ORDER:
                 if challenges.has_key(scheme):
-                    yield AUTH_SCHEME_CLASSES[scheme](cred, host, request_uri, headers, response, content, self)
+                    authorization = AUTH_SCHEME_CLASSES[scheme](cred, host, request_uri, headers, response, content, self)
+                    authorization.scheme = scheme
+                    authorization.realm = challenges[scheme].get('realm')
+                    yield authorization
 
     def add_credentials(self, name, password, domain=""):
         """Add a name and password that will be used
@@ -854,9 +1351,9 @@ the same interface as FileCache."""
         """Remove all the names and passwords
         that are used for authentication"""
         self.credentials.clear()
-        self.authorizations = []
+        self.authorizations = _AuthorizationIndex()
 
-    def _conn_request(self, conn, request_uri, method, body, headers):
+    def _conn_request(self, conn, request_uri, method, body, headers, stream=False):
         for i in range(2):
             try:
                 conn.request(method, request_uri, body, headers)
@@ -878,40 +1375,45 @@ the same interface as FileCache."""
                     raise
             else:
                 content = ""
+                http_response = response
+                response = Response(http_response)
                 if method == "HEAD":
-                    response.close()
+                    http_response.close()
+                elif stream and 200 <= response.status < 300:
+                    content = ResponseStream(response, http_response)
                 else:
-                    content = response.read()
-                response = Response(response)
-                if method != "HEAD":
-                    content = _decompressContent(response, content)
+                    content = _decompressContent(response, http_response)
             break
         return (response, content)
 
 
-    def _request(self, conn, host, absolute_uri, request_uri, method, body, headers, redirections, cachekey):
+    def _request(self, conn, host, absolute_uri, request_uri, method, body, headers, redirections, cachekey, stream=False):
         """Do the actual request using the connection object
         and also follow one level of redirects if necessary"""
 
-        auths = [(auth.depth(request_uri), auth) for auth in self.authorizations if auth.inscope(host, request_uri)]
-        auth = auths and sorted(auths)[0][1] or None
+        # Answer any challenge already met for this protection space up
+        # front, saving the round trip of a 401
+        auth = self.authorizations.find(host, request_uri)
         if auth: 
             auth.request(method, request_uri, headers, body)
 
-        (response, content) = self._conn_request(conn, request_uri, method, body, headers)
+        (response, content) = self._conn_request(conn, request_uri, method, body, headers, stream)
 
         if auth: 
             if auth.response(response, body):
+                if isinstance(content, ResponseStream):
+                    # Finish this response before reusing the connection
+                    content.read()
                 auth.request(method, request_uri, headers, body)
-                (response, content) = self._conn_request(conn, request_uri, method, body, headers )
+                (response, content) = self._conn_request(conn, request_uri, method, body, headers, stream)
                 response._stale_digest = 1
 
         if response.status == 401:
             for authorization in self._auth_from_challenge(host, request_uri, headers, response, content):
                 authorization.request(method, request_uri, headers, body) 
-                (response, content) = self._conn_request(conn, request_uri, method, body, headers, )
+                (response, content) = self._conn_request(conn, request_uri, method, body, headers, stream)
                 if response.status != 401:
-                    self.authorizations.append(authorization)
+                    self.authorizations.add(authorization)
                     authorization.response(response, body)
                     break
 
@@ -943,7 +1445,7 @@ the same interface as FileCache."""
                         if not old_response.has_key('content-location'):
                             old_response['content-location'] = absolute_uri 
                         redirect_method = ((response.status == 303) and (method not in ["GET", "HEAD"])) and "GET" or method
-                        (response, content) = self.request(location, redirect_method, body=body, headers = headers, redirections = redirections - 1)
+                        (response, content) = self.request(location, redirect_method, body=body, headers = headers, redirections = redirections - 1, stream=stream)
                         response.previous = old_response
                 else:
                     raise RedirectLimit( _("Redirected more times than rediection_limit allows."), response, content)
@@ -951,8 +1453,38 @@ the same interface as FileCache."""
                 # Don't cache 206's since we aren't going to handle byte range requests
                 if not response.has_key('content-location'):
                     response['content-location'] = absolute_uri 
-                _updateCache(headers, response, content, self.cache, cachekey)
+                if isinstance(content, ResponseStream):
+                    if cachekey:
+                        # Cache the body as it streams past, unless it is
+                        # too big for a size bounded cache
+                        def update(content, response=response, cachekey=cachekey):
+                            _updateCache(headers, response, content, self.cache, cachekey)
+                        content.tee(update, getattr(self.cache, 'max_bytes', None))
+                else:
+                    _updateCache(headers, response, content, self.cache, cachekey)
+
+        return (response, content)
 
+    def _pooled_request(self, conn_key, connect, host, absolute_uri, request_uri, method, body, headers, redirections, cachekey, stream=False):
+        """Do the request on a connection checked out of the pool for
+        conn_key, a connection that fails is not handed out again"""
+        conn = self.connections.checkout(conn_key, connect)
+        reusable = False
+        try:
+            (response, content) = self._request(conn, host, absolute_uri, request_uri, method, body, headers, redirections, cachekey, stream)
+            reusable = True
+        except:
+            self.connections.checkin(conn_key, conn, reusable)
+            raise
+        if isinstance(content, ResponseStream) and not content._pooled:
+            # The connection goes back once the body has been read
+            content._pooled = True
+            self.connections.hand_off()
+            def checkin(complete):
+                self.connections.checkin(conn_key, conn, complete, owned=False)
+            content.on_close(checkin)
+        else:
+            self.connections.checkin(conn_key, conn, reusable)
         return (response, content)
 
     def _normalize_headers(self, headers):
@@ -963,7 +1495,7 @@ the same interface as FileCache."""
 # including all socket.* and httplib.* exceptions.
 
 
-    def request(self, uri, method="GET", body=None, headers=None, redirections=DEFAULT_MAX_REDIRECTS, connection_type=None):
+    def request(self, uri, method="GET", body=None, headers=None, redirections=DEFAULT_MAX_REDIRECTS, connection_type=None, stream=False):
         """ Performs a single HTTP request.
 The 'uri' is the URI of the HTTP resource and can begin 
 with either 'http' or 'https'. The value of 'uri' must be an absolute URI.
@@ -983,6 +1515,10 @@ exception is 'redirections. The default is 5.
 The return value is a tuple of (response, content), the first 
 being and instance of the 'Response' class, the second being 
 a string that contains the response entity body.
+
+If 'stream' is True the content is instead a ResponseStream, an iterator
+over the decompressed body that reads it from the socket as it is
+consumed, so a large body never has to be held in memory whole.
         """
         try:
             if headers is None:
@@ -1002,18 +1538,17 @@ a string that contains the response entity body.
                 authority = domain_port[0]
 
             conn_key = scheme+":"+authority
-            if conn_key in self.connections:
-                conn = self.connections[conn_key]
-            else:
+            def connect(connection_type=connection_type):
                 if not connection_type:
                     connection_type = (scheme == 'https') and HTTPSConnectionWithTimeout or HTTPConnectionWithTimeout
                 certs = list(self.certificates.iter(authority))
                 if scheme == 'https' and certs:
-                    conn = self.connections[conn_key] = connection_type(authority, key_file=certs[0][0],
+                    conn = connection_type(authority, key_file=certs[0][0],
                         cert_file=certs[0][1], timeout=self.timeout, proxy_info=self.proxy_info)
                 else:
-                    conn = self.connections[conn_key] = connection_type(authority, timeout=self.timeout, proxy_info=self.proxy_info)
+                    conn = connection_type(authority, timeout=self.timeout, proxy_info=self.proxy_info)
                 conn.set_debuglevel(debuglevel)
+                return conn
 
             if method in ["GET", "HEAD"] and 'range' not in headers and 'accept-encoding' not in headers:
                 headers['accept-encoding'] = 'gzip, deflate'
@@ -1023,7 +1558,12 @@ a string that contains the response entity body.
             if self.cache:
                 cachekey = defrag_uri
                 cached_value = self.cache.get(cachekey)
-                if cached_value:
+                if isinstance(cached_value, tuple):
+                    # Caches with parsed_entries hand back the headers as a
+                    # dict, copied as it is updated below
+                    info, content = cached_value
+                    info = dict(info)
+                elif cached_value:
                     # info = email.message_from_string(cached_value)
                     #
                     # Need to replace the line above with the kludge below
@@ -1057,7 +1597,7 @@ a string that contains the response entity body.
                 vary_headers = vary.lower().replace(' ', '').split(',')
                 for header in vary_headers:
                     key = '-varied-%s' % header
-                    value = info[key]
+                    value = info.get(key)
                     if headers.get(header, '') != value:
                             cached_value = None
                             break
@@ -1065,7 +1605,7 @@ a string that contains the response entity body.
             if cached_value and method in ["GET", "HEAD"] and self.cache and 'range' not in headers:
                 if info.has_key('-x-permanent-redirect-url'):
                     # Should cached permanent redirects be counted in our redirection count? For now, yes.
-                    (response, new_content) = self.request(info['-x-permanent-redirect-url'], "GET", headers = headers, redirections = redirections - 1)
+                    (response, new_content) = self.request(info['-x-permanent-redirect-url'], "GET", headers = headers, redirections = redirections - 1, stream=stream)
                     response.previous = Response(info)
                     response.previous.fromcache = True
                 else:
@@ -1086,6 +1626,8 @@ a string that contains the response entity body.
                         response = Response(info)
                         if cached_value:
                             response.fromcache = True
+                        if stream:
+                            content = ResponseStream(response, content=content)
                         return (response, content)
 
                     if entry_disposition == "STALE":
@@ -1096,7 +1638,7 @@ a string that contains the response entity body.
                     elif entry_disposition == "TRANSPARENT":
                         pass
 
-                    (response, new_content) = self._request(conn, authority, uri, request_uri, method, body, headers, redirections, cachekey)
+                    (response, new_content) = self._pooled_request(conn_key, connect, authority, uri, request_uri, method, body, headers, redirections, cachekey, stream)
 
                 if response.status == 304 and method == "GET":
                     # Rewrite the cache entry with the new end-to-end headers
@@ -1126,7 +1668,7 @@ a string that contains the response entity body.
                     response = Response(info)
                     content = ""
                 else:
-                    (response, content) = self._request(conn, authority, uri, request_uri, method, body, headers, redirections, cachekey)
+                    (response, content) = self._pooled_request(conn_key, connect, authority, uri, request_uri, method, body, headers, redirections, cachekey, stream)
         except Exception, e:
             if self.force_exception_to_status_code:
                 if isinstance(e, HttpLib2ErrorWithResponse):
@@ -1153,7 +1695,8 @@ a string that contains the response entity body.
             else:
                 raise
 
- 
+        if stream and not isinstance(content, ResponseStream):
+            content = ResponseStream(response, content=content)
         return (response, content)
 
  
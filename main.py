@@ -42,18 +42,67 @@ from localsettings import *
 MAX_TWEETS_PER_PAGE = 200
 TWITTER_CALL_DELAY = 1
 
+# Each retreiver task archives up to INGEST_PAGES pages.  The next page is
+# fetched from twitter while the datastore writes of up to
+# INGEST_PENDING_PUTS earlier pages are still in flight.
+INGEST_PAGES = 4
+INGEST_PENDING_PUTS = 2
+
+# Rehydrating an archive refreshes REHYDRATE_BATCH_SIZE tweets per task,
+# one statuses/lookup call per hundred tweets.
+REHYDRATE_BATCH_SIZE = 500
+
+# Deleting a stream fans out over this many date ranges, each range is
+# purged PURGE_BATCH_SIZE tweets at a time with PURGE_DELAY seconds between
+# batches so the purge-tweets queue never crowds out get-tweets.
+PURGE_QUEUE = "purge-tweets"
+PURGE_PARTITIONS = 8
+PURGE_BATCH_SIZE = 100
+PURGE_DELAY = 2
+
+# Sharded counters start with COUNTER_MIN_SHARDS shards and double, up to
+# COUNTER_MAX_SHARDS, once COUNTER_GROW_COLLISIONS shard transactions have
+# collided within COUNTER_WINDOW seconds.  Counters untouched for
+# COUNTER_IDLE_DAYS are folded back down to COUNTER_MIN_SHARDS.
+COUNTER_MIN_SHARDS = 2
+COUNTER_MAX_SHARDS = 64
+COUNTER_RETRIES = 5
+COUNTER_GROW_COLLISIONS = 10
+COUNTER_WINDOW = 60
+COUNTER_IDLE_DAYS = 7
+
+# Counter totals are cached as integers and kept current by increment(),
+# so the cached total can live much longer than a minute.  An increment
+# that finds no total to add to bumps the counter's "-dirty" marker, and a
+# total summed while the marker moved is thrown away.
+COUNTER_CACHE_TIMEOUT = 3600
+
+# Followers and friends are snapshotted daily.  Every GRAPH_FULL_DAYS days
+# the whole ID set is stored, the days in between only store the IDs added
+# and removed since the snapshot before, so storage grows with churn.
+GRAPH_KINDS = ('followers', 'friends')
+GRAPH_FULL_DAYS = 30
+
+# A snapshot holds at most GRAPH_CHUNK_IDS IDs per field, the rest spill
+# into GraphChunks so no entity gets near the 1MB limit (an encoded ID
+# takes at most 10 bytes).
+GRAPH_CHUNK_IDS = 50000
+
 
 # -- http://code.google.com/appengine/articles/sharding_counters.html ----
 class GeneralCounterShardConfig(db.Model):
     """Tracks the number of shards for each named counter."""
     name = db.StringProperty(required=True)
-    num_shards = db.IntegerProperty(required=True, default=20)
+    num_shards = db.IntegerProperty(required=True, default=COUNTER_MIN_SHARDS)
 
 
 class GeneralCounterShard(db.Model):
-    """Shards for each named counter"""
+    """Shards for each named counter.  A retired shard was folded away by
+    compact_counter and refuses increments until the counter grows again"""
     name = db.StringProperty(required=True)
     count = db.IntegerProperty(required=True, default=0)
+    updated = db.DateTimeProperty(auto_now=True)
+    retired = db.BooleanProperty(default=False)
 
 
 def get_count(name):
@@ -64,30 +113,162 @@ def get_count(name):
     """
     total = memcache.get(name)
     if total is None:
-        total = 0
-        for counter in GeneralCounterShard.all().filter('name = ', name):
-            total += counter.count
-        memcache.add(name, str(total), 60)
+        dirty = name + "-dirty"
+        memcache.add(dirty, 0, COUNTER_CACHE_TIMEOUT)
+        marker = memcache.get(dirty)
+        total = sum([x.count for x in get_shards(name)])
+        memcache.add(name, total, COUNTER_CACHE_TIMEOUT)
+
+        # An increment missed the cache while the shards were summed, the
+        # total may be short of it
+        if marker is None or memcache.get(dirty) != marker:
+            memcache.delete(name)
     return total
 
 
-def increment(name):
+def get_shards(name, num_shards=None):
+    """Fetch the existing shards of a sharded counter with one batch get.
+
+    Shard key names are the counter name followed by the shard index, so
+    the shards are read by key rather than queried by name.
+
+    Parameters:
+      name - The name of the counter
+      num_shards - The counter's shard count, read from its config if None
+    """
+    if num_shards is None:
+        config = GeneralCounterShardConfig.get_by_key_name(name)
+        if config is None:
+            return []
+        num_shards = config.num_shards
+    shard_names = [name + str(index) for index in xrange(num_shards)]
+    return [x for x in GeneralCounterShard.get_by_key_name(shard_names) if x]
+
+
+def increment(name, delta = 1):
     """Increment the value for a given sharded counter.
 
+    Every failed shard transaction is counted as a collision, and a counter
+    that collides too often within COUNTER_WINDOW gets more shards.  A shard
+    retired by compact_counter since the shard count was read is skipped
+    and the count read again.
+
     Parameters:
       name - The name of the counter
+      delta - The amount to add to the counter
     """
     config = GeneralCounterShardConfig.get_or_insert(name, name=name)
-    def txn():
-        index = random.randint(0, config.num_shards - 1)
+    def txn(index):
         shard_name = name + str(index)
         counter = GeneralCounterShard.get_by_key_name(shard_name)
         if counter is None:
             counter = GeneralCounterShard(key_name=shard_name, name=name)
-        counter.count += 1
+        elif counter.retired:
+            return False
+        counter.count += delta
         counter.put()
-    db.run_in_transaction(txn)
-    memcache.incr(name)
+        return True
+
+    for attempt in xrange(COUNTER_RETRIES + 1):
+        # Pick a fresh shard for every attempt, retrying on the shard that
+        # just collided would most likely collide again
+        index = random.randint(0, config.num_shards - 1)
+        try:
+            if db.run_in_transaction_custom_retries(0, txn, index):
+                break
+            config = GeneralCounterShardConfig.get_by_key_name(name)
+        except db.TransactionFailedError:
+            if attempt == COUNTER_RETRIES:
+                raise
+            record_collision(name)
+    else:
+        raise db.TransactionFailedError("no live shard for counter "+name)
+
+    # Nothing cached to add to, a get_count() may be summing the shards
+    # right now and miss this increment
+    if memcache.incr(name, delta) is None:
+        memcache.incr(name + "-dirty")
+        memcache.delete(name)
+
+
+def record_collision(name):
+    """Count a shard collision and grow the counter when it is contended.
+
+    Parameters:
+      name - The name of the counter
+    """
+    key = name + "-collisions"
+    memcache.add(key, 0, COUNTER_WINDOW)
+    collisions = memcache.incr(key)
+    if collisions is None or collisions < COUNTER_GROW_COLLISIONS:
+        return
+
+    memcache.delete(key)
+    def txn():
+        config = GeneralCounterShardConfig.get_by_key_name(name)
+        num_shards = config.num_shards
+        if config.num_shards < COUNTER_MAX_SHARDS:
+            config.num_shards = min(config.num_shards * 2, COUNTER_MAX_SHARDS)
+            config.put()
+        return num_shards, config.num_shards
+    old_shards, num_shards = db.run_in_transaction(txn)
+
+    # Shards retired by an earlier compaction are back in use
+    def revive(shard_name):
+        shard = GeneralCounterShard.get_by_key_name(shard_name)
+        if shard and shard.retired:
+            shard.retired = False
+            shard.put()
+    for index in xrange(old_shards, num_shards):
+        db.run_in_transaction(revive, name + str(index))
+    logging.info("counter "+name+" contended, now "+str(num_shards)+" shards")
+
+
+def compact_counter(name):
+    """Fold the shards of an idle counter down to COUNTER_MIN_SHARDS.
+
+    The shard count is lowered first so new increments only land on the
+    remaining shards.  Each surplus shard is then emptied and retired in
+    one transaction, so an increment that read the old shard count either
+    lands before and is folded along or is refused and goes elsewhere,
+    and its count is added into a remaining shard.  Retired shards are
+    kept rather than deleted so a late increment cannot recreate them.
+
+    Parameters:
+      name - The name of the counter
+    """
+    def shrink():
+        config = GeneralCounterShardConfig.get_by_key_name(name)
+        num_shards = config.num_shards
+        config.num_shards = min(num_shards, COUNTER_MIN_SHARDS)
+        config.put()
+        return num_shards
+    num_shards = db.run_in_transaction(shrink)
+
+    def retire(shard_name):
+        shard = GeneralCounterShard.get_by_key_name(shard_name)
+        if shard is None:
+            shard = GeneralCounterShard(key_name=shard_name, name=name)
+        count = shard.count
+        shard.count = 0
+        shard.retired = True
+        shard.put()
+        return count
+
+    def fold(shard_name, count):
+        counter = GeneralCounterShard.get_by_key_name(shard_name)
+        if counter is None:
+            counter = GeneralCounterShard(key_name=shard_name, name=name)
+        counter.count += count
+        counter.put()
+
+    for index in xrange(COUNTER_MIN_SHARDS, num_shards):
+        count = db.run_in_transaction(retire, name + str(index))
+        if count:
+            db.run_in_transaction(fold, name + str(index % COUNTER_MIN_SHARDS), count)
+
+    memcache.delete(name)
+    logging.info("compacted counter "+name+" from "+str(num_shards)+" shards")
 # -- http://code.google.com/appengine/articles/sharding_counters.html ----
 
 
@@ -103,6 +284,16 @@ class TweetStream(db.Model):
     lastupdated = db.DateTimeProperty(auto_now_add = True)
     owner = db.UserProperty(required = True)
 
+    # Purge progress, only meaningful once enabled is False.  purge_batches
+    # holds the last batch counted for each date range (the final sweep is
+    # range PURGE_PARTITIONS) and purge_done the ranges finished, so a
+    # retried deleter is never counted twice.
+    purge_total = db.IntegerProperty(default = 0)
+    purged = db.IntegerProperty(default = 0)
+    purge_pending = db.IntegerProperty(default = 0)
+    purge_batches = db.ListProperty(int)
+    purge_done = db.ListProperty(int)
+
 
 class Tweet(search.SearchableModel):
     """Represents one tweet"""
@@ -114,11 +305,41 @@ class Tweet(search.SearchableModel):
     created = db.DateTimeProperty()
     owner = db.UserProperty(required = True)
 
+    # Set when a rehydration finds the status gone from twitter
+    deleted = db.BooleanProperty(default = False)
+
     @classmethod
     def SearchableProperties(cls):
         return [['content']]    
 
 
+class GraphSnapshot(db.Model):
+    """One day of a tweetstream's followers or friends.  A full snapshot
+    (day == base) holds every ID, the others hold the IDs added and removed
+    since the previous snapshot.  IDs are encoded with encode_ids(), those
+    beyond the first GRAPH_CHUNK_IDS of a field are in its GraphChunks"""
+
+    tweetstream = db.ReferenceProperty(TweetStream, required = True)
+    kind = db.StringProperty(required = True, choices = GRAPH_KINDS)
+    day = db.DateProperty(required = True)
+    base = db.DateProperty(required = True)
+    count = db.IntegerProperty(default = 0)
+    ids = db.BlobProperty()
+    added = db.BlobProperty()
+    removed = db.BlobProperty()
+    chunks = db.IntegerProperty(default = 0)
+
+
+class GraphChunk(db.Model):
+    """Up to GRAPH_CHUNK_IDS more IDs of each field of a GraphSnapshot,
+    keyed by the snapshot's key name and the chunk number"""
+
+    tweetstream = db.ReferenceProperty(TweetStream, required = True)
+    ids = db.BlobProperty()
+    added = db.BlobProperty()
+    removed = db.BlobProperty()
+
+
 # -- Controllers ---------------------------------------------------------
 class Welcome(webapp.RequestHandler):
     """The welcome page, information and login"""
@@ -170,7 +391,7 @@ class Tweets(webapp.RequestHandler):
 
         if tweetstream:
 
-            countername = str(tweetstream.owner)+"-"+str(tweetstream.twitterid)+"-"
+            countername = get_countername(tweetstream)
             tweetcount = int(get_count(countername))
             tscount = tweetstream.count
 
@@ -254,17 +475,18 @@ class Refresh(webapp.RequestHandler):
         page = 1
         pages = ceil(tweetstream.count/MAX_TWEETS_PER_PAGE)+1
         
-        for i in xrange(1, int(pages)+1):
+        for i in xrange(1, int(pages)+1, INGEST_PAGES):
             taskqueue.add(url = "/tweetretreiver", 
                 queue_name = "get-tweets",
                 name = "GetTweets-"+tweetstream.twitteruser+"-"+str(i)+"-"+str(int(time.time())),
                 countdown = TWITTER_CALL_DELAY * i,
                 params = {
                     'page': i,
+                    'pages': INGEST_PAGES,
                     'tsid': tweetstream.key()
                     },
                 )
-            logging.info('Enqueued get-tweets for page'+str(i)+" start at tweet "+str(MAX_TWEETS_PER_PAGE*i))
+            logging.info('Enqueued get-tweets for pages '+str(i)+" to "+str(i+INGEST_PAGES-1)+" start at tweet "+str(MAX_TWEETS_PER_PAGE*i))
 
         # notice to the user
         flash.msg += "Twitter stream queued for archive. "+str(pages)+" operations required, this could take a few minutes."
@@ -272,6 +494,38 @@ class Refresh(webapp.RequestHandler):
         self.redirect('/tweets?tsid='+tsid)
 
 
+class Rehydrate(webapp.RequestHandler):
+    """Refresh the raw payload of every archived tweet of a twitter stream
+    and flag the tweets deleted from twitter"""
+
+    def get(self):
+        flash = Flash()
+
+        user = users.get_current_user()
+        tsid = self.request.get("tsid")
+
+        if not user: 
+            self.redirect("/")
+            return
+
+        tweetstream = get_tweetstream(tsid)
+        if not tweetstream:
+            flash.msg = "I couldn't find the correct twitter stream to rehydrate. Sorry."
+            self.redirect("/tweets")
+            return
+
+        taskqueue.add(url = "/tweetrehydrator", 
+            queue_name = "get-tweets",
+            name = "RehydrateTweets-"+tweetstream.twitteruser+"-"+str(int(time.time())),
+            params = {
+                'tsid': tweetstream.key()
+                },
+            )
+
+        flash.msg = "Twitter stream queued for rehydration, this could take a few minutes."
+        self.redirect('/tweets?tsid='+str(tweetstream.key()))
+
+
 class RefreshAll(webapp.RequestHandler):
     """
     Archive the first page of all twitter streams
@@ -280,7 +534,7 @@ class RefreshAll(webapp.RequestHandler):
 
     def get(self):
 
-        for tweetstream in TweetStream.all():
+        for tweetstream in TweetStream.all().filter('enabled =', True):
             
             # get the latest 200 tweets and archive them
             taskqueue.add(url = "/tweetretreiver", 
@@ -293,6 +547,43 @@ class RefreshAll(webapp.RequestHandler):
                 )
 
 
+class CompactCounters(webapp.RequestHandler):
+    """Shrink the sharded counters that have gone idle"""
+
+    def get(self):
+
+        cutoff = datetime.datetime.now() - datetime.timedelta(days = COUNTER_IDLE_DAYS)
+
+        for config in GeneralCounterShardConfig.all().filter('num_shards >', COUNTER_MIN_SHARDS):
+            shards = get_shards(config.name, config.num_shards)
+            if [x for x in shards if x.updated and x.updated > cutoff]:
+                continue
+            compact_counter(config.name)
+
+
+class SnapshotAllGraphs(webapp.RequestHandler):
+    """Queue today's follower and friend snapshot of all twitter streams"""
+
+    def get(self):
+
+        day = datetime.date.today()
+        for tweetstream in TweetStream.all().filter('enabled =', True):
+
+            # named per stream and day, so a second run of the cron queues
+            # nothing
+            try:
+                taskqueue.add(url = "/graphsnapshotter",
+                    queue_name = "get-tweets",
+                    name = "SnapshotGraph-"+str(tweetstream.key())+"-"+day.strftime('%Y%m%d'),
+                    params = {
+                        'day': day.isoformat(),
+                        'tsid': tweetstream.key()
+                        },
+                    )
+            except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+                logging.info("Graph of "+tweetstream.twitteruser+" already queued")
+
+
 class Configure(webapp.RequestHandler):
     """Configure which twitter account to archive"""
 
@@ -325,12 +616,20 @@ class Configure(webapp.RequestHandler):
             # Delete all existing archived tweets and associated support classes
             tweetstream = TweetStream.get(self.request.get("tsid"))
             tweetstream.enabled = False
+            tweetstream.purge_total = int(get_count(get_countername(tweetstream)))
+            tweetstream.purged = 0
+            tweetstream.purge_pending = 0
+            tweetstream.purge_batches = []
+            tweetstream.purge_done = []
             tweetstream.put()
 
+            purge = str(int(time.time()))
             taskqueue.add(
-                url = "/tweetdeleter", 
-                name = "DeleteAllTweets-"+str(tweetstream.twitteruser)+"-"+str(int(time.time())),
+                url = "/tweetpurge", 
+                queue_name = PURGE_QUEUE,
+                name = "PurgeTweets-"+str(tweetstream.twitteruser)+"-"+purge,
                 params = {
+                    'purge': purge,
                     'tsid': str(tweetstream.key())
                     }
                 )
@@ -338,6 +637,9 @@ class Configure(webapp.RequestHandler):
         elif self.request.get("action") == "add":
             twitteruser = self.request.get("twitteruser")
             tweetstream = new_tweetstream(twitteruser = twitteruser)
+            if not tweetstream:
+                self.redirect("/configure")
+                return
             self.redirect("/refresh?tsid="+str(tweetstream.key()))
             return
 
@@ -355,7 +657,7 @@ def new_tweetstream(twitteruser = ""):
     
     # Create the tweetstream only if it doesn't exist already and we can find the 
     # twitter user
-    api = twitter.Api(cache = None)
+    api = twitter.Api(cache = twitter.MemcacheCache())
 
     # A few global updates to the tweetstream
     statuses = api.GetUserTimeline(twitteruser, count = 1)
@@ -371,13 +673,21 @@ def new_tweetstream(twitteruser = ""):
     
     key_name = user.email()+"-"+twitteruser
 
+    # A stream that is still being purged keeps its key until the purge
+    # is done, don't hand it back half deleted
+    tweetstream = TweetStream.get_by_key_name(key_name)
+    if tweetstream and not tweetstream.enabled:
+        flash = Flash()
+        flash.msg = twitteruser+" is still being deleted, add it again once it is gone"
+        return None
+
     tweetstream = TweetStream.get_or_insert(
         owner = user,
         twitteruser = twitteruser,
         key_name = key_name
         )
     tweetstream.twitterid = status.user.id
-    tweetstream.raw = str(status)
+    tweetstream.raw = db.Text(status.raw_json, encoding = 'utf-8')
     tweetstream.count = status.user.statuses_count
     tweetstream.put()
 
@@ -407,6 +717,199 @@ def get_tweetstream(tsid = None):
 
     return tweetstream
 
+def get_countername(tweetstream):
+    """Name of the sharded counter holding a tweetstream's archived count"""
+
+    return str(tweetstream.owner)+"-"+str(tweetstream.twitterid)+"-"
+
+def record_purge_progress(tsid, part, batch, purged = 0, finished = False):
+    """Add one deleter batch to a tweetstream's purge progress, once only
+    however often the batch is retried.  Returns the number of date ranges
+    still being purged, or None once the tweetstream is gone"""
+
+    def txn():
+        tweetstream = TweetStream.get(tsid)
+        if not tweetstream:
+            return None
+        batches = tweetstream.purge_batches or [-1] * (PURGE_PARTITIONS + 1)
+        if batch > batches[part]:
+            batches[part] = batch
+            tweetstream.purge_batches = batches
+            tweetstream.purged += purged
+        if finished and part not in tweetstream.purge_done:
+            tweetstream.purge_done.append(part)
+            tweetstream.purge_pending = max(tweetstream.purge_pending - 1, 0)
+        tweetstream.put()
+        return tweetstream.purge_pending
+    return db.run_in_transaction(txn)
+
+def new_tweets(tweetstream, statuses):
+    """Build the Tweet entities for the statuses that are not archived yet,
+    looking up the existing ones in a single batch"""
+
+    prefix = str(tweetstream.key())+"-"
+    key_names = [prefix+str(status.id) for status in statuses]
+    existing = Tweet.get_by_key_name(key_names)
+
+    tweets = []
+    for status, key_name, tweet in zip(statuses, key_names, existing):
+
+        # Don't save statuses we've already saved
+        if tweet:
+            continue
+
+        try:
+            tweet = Tweet(tweetstream = tweetstream, owner = tweetstream.owner, key_name = key_name)
+            tweet.tweetid = str(status.id)
+            tweet.content = status.text
+            tweet.raw = db.Text(status.raw_json, encoding = 'utf-8')
+            tweet.created = datetime.datetime.strptime(
+                status.created_at, 
+                '%a %b %d %H:%M:%S +0000 %Y'
+                )
+            tweets.append(tweet)
+        except:
+            logging.info("Error saving status: "+status.text)
+    return tweets
+
+def finish_put(countername, rpc, tweets):
+    """Wait for an asynchronous put of tweets and count the saved tweets"""
+
+    try:
+        rpc.get_result()
+    except:
+        logging.info("Error saving "+str(len(tweets))+" statuses")
+        return
+
+    # http://code.google.com/appengine/articles/sharding_counters.html
+    # use a sharded counter instead of .count()
+    increment(countername, len(tweets))
+
+def encode_ids(ids):
+    """Encode a set of non-negative IDs as the varints of the differences
+    between the sorted IDs"""
+
+    out = []
+    last = 0
+    for x in sorted(ids):
+        delta = x - last
+        last = x
+        while delta > 0x7f:
+            out.append(chr(delta & 0x7f | 0x80))
+            delta >>= 7
+        out.append(chr(delta))
+    return ''.join(out)
+
+def decode_ids(data):
+    """The sorted list of IDs encoded by encode_ids()"""
+
+    ids = []
+    last = delta = shift = 0
+    for byte in data or '':
+        byte = ord(byte)
+        delta |= (byte & 0x7f) << shift
+        if byte & 0x80:
+            shift += 7
+            continue
+        last += delta
+        ids.append(last)
+        delta = shift = 0
+    return ids
+
+def split_ids(ids):
+    """Encode a set of IDs as a list of encode_ids() chunks of at most
+    GRAPH_CHUNK_IDS IDs each"""
+
+    ids = sorted(ids)
+    return [encode_ids(ids[i:i + GRAPH_CHUNK_IDS])
+        for i in xrange(0, len(ids), GRAPH_CHUNK_IDS)] or ['']
+
+def get_graph_chunks(snapshot):
+    """A GraphSnapshot followed by the GraphChunks holding the rest of its
+    IDs"""
+
+    if not snapshot.chunks:
+        return [snapshot]
+    prefix = snapshot.key().name()+"-"
+    return [snapshot] + GraphChunk.get_by_key_name(
+        [prefix+str(n) for n in xrange(1, snapshot.chunks + 1)])
+
+def get_graph_key_names(tweetstream, kind, days):
+    """Key names of a tweetstream's GraphSnapshots for a list of days"""
+
+    prefix = str(tweetstream.key())+"-"+kind+"-"
+    return [prefix+day.isoformat() for day in days]
+
+def get_graph(tweetstream, kind, day):
+    """Rebuild a tweetstream's followers or friends as of a day from the
+    last full snapshot and the changes recorded after it.  Returns the set
+    of IDs and the day of the full snapshot, or (None, None) when nothing
+    was snapshotted in the GRAPH_FULL_DAYS days up to day"""
+
+    days = [day - datetime.timedelta(days = n) for n in xrange(GRAPH_FULL_DAYS - 1, -1, -1)]
+    snapshots = GraphSnapshot.get_by_key_name(get_graph_key_names(tweetstream, kind, days))
+    snapshots = [x for x in snapshots if x]
+    if not snapshots:
+        return None, None
+
+    # The full snapshot may be older than the window when days were missed
+    base = snapshots[-1].base
+    if base < days[0]:
+        earlier = [base + datetime.timedelta(days = n) for n in xrange((days[0] - base).days)]
+        snapshots = [x for x in GraphSnapshot.get_by_key_name(
+            get_graph_key_names(tweetstream, kind, earlier)) if x] + snapshots
+
+    ids = set()
+    for snapshot in snapshots:
+        if snapshot.day < base:
+            continue
+        parts = get_graph_chunks(snapshot)
+        if snapshot.day == base:
+            ids = set()
+            for part in parts:
+                ids.update(decode_ids(part.ids))
+        else:
+            for part in parts:
+                ids.difference_update(decode_ids(part.removed))
+                ids.update(decode_ids(part.added))
+    return ids, base
+
+def snapshot_graph(tweetstream, kind, day, ids):
+    """Build the GraphSnapshot of a day's IDs, a full one when the last full
+    snapshot is GRAPH_FULL_DAYS old and the changes since the day before
+    otherwise.  Returns the snapshot followed by its GraphChunks"""
+
+    ids = set(ids)
+    previous, base = get_graph(tweetstream, kind, day - datetime.timedelta(days = 1))
+    if previous is None or (day - base).days >= GRAPH_FULL_DAYS:
+        base = day
+
+    if base == day:
+        fields = {'ids': split_ids(ids)}
+    else:
+        fields = {
+            'added': split_ids(ids - previous),
+            'removed': split_ids(previous - ids)
+            }
+    chunks = max([len(x) for x in fields.values()]) - 1
+
+    key_name = get_graph_key_names(tweetstream, kind, [day])[0]
+    snapshot = GraphSnapshot(
+        key_name = key_name,
+        tweetstream = tweetstream,
+        kind = kind,
+        day = day,
+        base = base,
+        count = len(ids),
+        chunks = chunks
+        )
+    parts = [snapshot] + [GraphChunk(key_name = key_name+"-"+str(n), tweetstream = tweetstream)
+        for n in xrange(1, chunks + 1)]
+    for name, encoded in fields.items():
+        for part, data in zip(parts, encoded):
+            setattr(part, name, db.Blob(data))
+    return parts
+
 
 class Retreiver(webapp.RequestHandler):
     """Retrieve a batch of tweets and create tweet objects for them"""
@@ -417,7 +920,7 @@ class Retreiver(webapp.RequestHandler):
         # fail if the tweetstream is not supplied ofr not found
         if not self.request.get("tsid"): return
         tweetstream = TweetStream.get(self.request.get("tsid"))
-        if not tweetstream: return
+        if not tweetstream or not tweetstream.enabled: return
 
         twitteruser = tweetstream.twitteruser
         
@@ -425,9 +928,10 @@ class Retreiver(webapp.RequestHandler):
 
         # fail if the page is not supplied
         if not self.request.get("page"): return
-        page = self.request.get("page")
+        page = int(self.request.get("page"))
+        pages = int(self.request.get("pages") or 1)
 
-        api = twitter.Api(cache = None)
+        api = twitter.Api(cache = twitter.MemcacheCache())
 
         # Update the tweetstream statistics
         statuses = api.GetUserTimeline(twitteruser, count = 1)
@@ -437,44 +941,183 @@ class Retreiver(webapp.RequestHandler):
             return
 
         # update the vaules and save them
-        tweetstream.raw = str(status)
+        tweetstream.raw = db.Text(status.raw_json, encoding = 'utf-8')
         tweetstream.count = status.user.statuses_count
         tweetstream.put()
 
-        # Get a couple hundred tweets
-        statuses = api.GetUserTimeline(
-            twitteruser, 
-            page = page,
-            trim_user = True,
-            include_rts = True,
-            count = MAX_TWEETS_PER_PAGE
+        # Get a couple hundred tweets a page.  The writes of a page go out
+        # asynchronously and the next page is fetched while they are in
+        # flight, waiting on the oldest writes once too many are pending.
+        countername = get_countername(tweetstream)
+        pending = []
+        for page in xrange(page, page + pages):
+            statuses = api.GetUserTimeline(
+                twitteruser, 
+                page = page,
+                trim_user = True,
+                include_rts = True,
+                count = MAX_TWEETS_PER_PAGE
+                )
+            if not statuses:
+                break
+
+            tweets = new_tweets(tweetstream, statuses)
+            if tweets:
+                pending.append((db.put_async(tweets), tweets))
+            while len(pending) > INGEST_PENDING_PUTS:
+                rpc, tweets = pending.pop(0)
+                finish_put(countername, rpc, tweets)
+
+        for rpc, tweets in pending:
+            finish_put(countername, rpc, tweets)
+        logging.info("Done retreiver...")
+
+
+class Rehydrator(webapp.RequestHandler):
+    """Refresh a batch of archived tweets from twitter, looking them up a
+    hundred at a time, then queue the next batch"""
+
+    def post(self):
+        logging.info("Start rehydrator...")
+
+        if not self.request.get("tsid"): return
+        tweetstream = TweetStream.get(self.request.get("tsid"))
+        if not tweetstream or not tweetstream.enabled: return
+
+        query = Tweet.all().filter('tweetstream =', tweetstream)
+        if self.request.get("cursor"):
+            query.with_cursor(self.request.get("cursor"))
+        batch = query.fetch(REHYDRATE_BATCH_SIZE)
+        tweets = [x for x in batch if x.tweetid]
+
+        api = twitter.Api(cache = twitter.MemcacheCache())
+        statuses = api.HydrateStatuses(
+            [x.tweetid for x in tweets], 
+            max_workers = 1,
+            trim_user = True
             )
 
-        for status in statuses:
-
-            # Don't save statuses we've already saved
-            key_name = str(tweetstream.key())+"-"+str(status.id)
-
-            if not Tweet.get_by_key_name(key_name):
-                try:
-                    tweet = Tweet(tweetstream = tweetstream, owner = tweetstream.owner, key_name = key_name)
-                    tweet.tweetid = str(status.id)
-                    tweet.content = status.text
-                    tweet.raw = str(status)
-                    tweet.created = datetime.datetime.strptime(
-                        status.created_at, 
-                        '%a %b %d %H:%M:%S +0000 %Y'
-                        )
-                    tweet.put()
-
-                    # http://code.google.com/appengine/articles/sharding_counters.html
-                    # use a sharded counter instead of .count()
-                    countername = str(tweetstream.owner)+"-"+str(tweetstream.twitterid)+"-"
-                    increment(countername)
-
-                except:
-                    logging.info("Error saving status: "+status.text)
-        logging.info("Done retreiver...")
+        deleted = []
+        for tweet, (statusid, status) in zip(tweets, statuses):
+            if status is None:
+                tweet.deleted = True
+                deleted.append(tweet.tweetid)
+            else:
+                tweet.deleted = False
+                tweet.raw = db.Text(status.raw_json, encoding = 'utf-8')
+        db.put(tweets)
+
+        if deleted:
+            logging.info("Deleted from twitter: "+", ".join(deleted))
+        logging.info("Rehydrated "+str(len(tweets))+" tweets of "+tweetstream.twitteruser)
+
+        if len(batch) == REHYDRATE_BATCH_SIZE:
+            taskqueue.add(url = "/tweetrehydrator", 
+                queue_name = "get-tweets",
+                countdown = TWITTER_CALL_DELAY,
+                params = {
+                    'cursor': query.cursor(),
+                    'tsid': tweetstream.key()
+                    },
+                )
+        logging.info("Done rehydrator...")
+
+
+class GraphSnapshotter(webapp.RequestHandler):
+    """Snapshot the followers and friends of a tweetstream for a day"""
+
+    def post(self):
+
+        if not self.request.get("tsid"): return
+        tweetstream = TweetStream.get(self.request.get("tsid"))
+        if not tweetstream or not tweetstream.enabled or not tweetstream.twitterid: return
+
+        day = datetime.date.today()
+        if self.request.get("day"):
+            day = datetime.datetime.strptime(self.request.get("day"), '%Y-%m-%d').date()
+
+        logging.info("Snapshotting graph of "+tweetstream.twitteruser)
+
+        api = twitter.Api(cache = twitter.MemcacheCache())
+        parts = snapshot_graph(tweetstream, 'followers', day,
+            api.IterFollowerIDs(tweetstream.twitterid))
+        parts += snapshot_graph(tweetstream, 'friends', day,
+            api.IterFriendIDs(tweetstream.twitterid))
+
+        # Chunks go first, one per put to stay under the request size
+        # limit, so a snapshot is never read without its chunks
+        for part in parts:
+            if isinstance(part, GraphChunk):
+                part.put()
+        db.put([x for x in parts if isinstance(x, GraphSnapshot)])
+
+class Purger(webapp.RequestHandler):
+    """Split the purge of a tweetstream into date ranges and queue a
+    deleter for each range"""
+
+    def post(self):
+        logging.info("Start purger...")
+
+        tsid = self.request.get("tsid")
+        tweetstream = tsid and TweetStream.get(tsid) or None
+        if not tweetstream:
+            logging.info("could not purge tweetstream..."+tsid)
+            return
+
+        oldest = Tweet.all().filter("tweetstream =", tweetstream).order("created").get()
+        newest = Tweet.all().filter("tweetstream =", tweetstream).order("-created").get()
+
+        ranges = []
+        if oldest and newest and oldest.created and newest.created:
+            start = time.mktime(oldest.created.timetuple())
+            end = time.mktime(newest.created.timetuple()) + 1
+            step = (end - start) / PURGE_PARTITIONS
+            ranges = [(start + step*i, start + step*(i+1)) for i in xrange(PURGE_PARTITIONS)]
+            ranges[-1] = (ranges[-1][0], end)
+
+        # A retried purger leaves the progress of running deleters alone,
+        # its deleters are named so queueing them again is a no-op
+        purge = self.request.get("purge")
+        if not tweetstream.purge_batches and not tweetstream.purge_done:
+            tweetstream.purge_pending = len(ranges)
+            tweetstream.put()
+
+        if not ranges:
+            # Nothing dated to fan out over, sweep whatever is left
+            enqueue_deleter(tweetstream, purge, PURGE_PARTITIONS)
+
+        for i, (start, end) in enumerate(ranges):
+            enqueue_deleter(tweetstream, purge, i, 0, start, end, countdown = PURGE_DELAY * i)
+
+        logging.info("Queued "+str(len(ranges))+" deleters for "+str(tweetstream.twitteruser))
+
+
+def enqueue_deleter(tweetstream, purge, part, batch = 0, start = None, end = None, countdown = 0):
+    """Queue one batch of date range part of a tweetstream purge, a range of
+    None sweeps every remaining tweet and then the tweetstream itself.
+    Each batch is queued at most once"""
+
+    params = {
+        'tsid': str(tweetstream.key()),
+        'purge': purge,
+        'part': part,
+        'batch': batch
+        }
+    if start is not None:
+        params['start'] = repr(start)
+        params['end'] = repr(end)
+
+    try:
+        taskqueue.add(
+            url = "/tweetdeleter", 
+            queue_name = PURGE_QUEUE,
+            name = "DeleteTweets-"+str(tweetstream.key())+"-"+purge+"-"+str(part)+"-"+str(batch),
+            countdown = countdown,
+            params = params
+            )
+    except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+        logging.info("Deleter "+str(part)+"-"+str(batch)+" already queued")
+
 
 class Deleter(webapp.RequestHandler):
     
@@ -506,11 +1149,49 @@ class Deleter(webapp.RequestHandler):
             logging.info("could not delete tweetstream..."+tsid)
             return
 
-        # Remove all tweetstreams indicated for this user (cascade to the sharded counter entities)
+        if not tweetstream:
+            logging.info("tweetstream already deleted..."+tsid)
+            return
+
+        purge = self.request.get("purge")
+        part = int(self.request.get("part") or PURGE_PARTITIONS)
+        batch = int(self.request.get("batch") or 0)
+
+        query = Tweet.all(keys_only = True).filter("tweetstream =", tweetstream)
+        ranged = bool(self.request.get("start"))
+        if ranged:
+            start = float(self.request.get("start"))
+            end = float(self.request.get("end"))
+            query.filter("created >=", datetime.datetime.fromtimestamp(start))
+            query.filter("created <", datetime.datetime.fromtimestamp(end))
+
+        # Remove one batch of tweets, come back for the next after a pause
+        keys = query.fetch(PURGE_BATCH_SIZE)
+        db.delete(keys)
+
+        if len(keys) == PURGE_BATCH_SIZE:
+            if record_purge_progress(tsid, part, batch, purged = len(keys)) is None:
+                return
+            if ranged:
+                enqueue_deleter(tweetstream, purge, part, batch + 1, start, end, countdown = PURGE_DELAY)
+            else:
+                enqueue_deleter(tweetstream, purge, part, batch + 1, countdown = PURGE_DELAY)
+            return
+
+        if ranged:
+            # The last range to finish sweeps up undated tweets and the stream
+            if record_purge_progress(tsid, part, batch, purged = len(keys), finished = True) == 0:
+                enqueue_deleter(tweetstream, purge, PURGE_PARTITIONS)
+            return
+
+        if record_purge_progress(tsid, part, batch, purged = len(keys)) is None:
+            return
+
+        # Remove the tweetstream (cascade to the sharded counter entities)
         logging.info("got tweetstream "+str(tweetstream))
         logging.info("starting delete...")
 
-        countername = str(tweetstream.owner)+"-"+str(tweetstream.twitterid)+"-"
+        countername = get_countername(tweetstream)
 
         try:
             logging.info("deleting counter "+countername)
@@ -526,12 +1207,14 @@ class Deleter(webapp.RequestHandler):
             logging.info("failed deleting shards "+countername)
 
         try:
-            # Remove all tweet entries for this user
-            logging.info("deleting tweets")
-            for t in Tweet.all().filter("tweetstream =", tweetstream):
-                t.delete()
+            logging.info("deleting graph snapshots")
+            for model in (GraphSnapshot, GraphChunk):
+                keys = model.all(keys_only = True).filter('tweetstream =', tweetstream).fetch(PURGE_BATCH_SIZE)
+                while keys:
+                    db.delete(keys)
+                    keys = model.all(keys_only = True).filter('tweetstream =', tweetstream).fetch(PURGE_BATCH_SIZE)
         except:
-            logging.info("failed deleting tweets "+str(tweetstream))
+            logging.info("failed deleting graph snapshots "+str(tweetstream))
 
         try:
             logging.info("deleting tweetstream")
@@ -629,10 +1312,16 @@ application = webapp.WSGIApplication([
     ('/tweets', Tweets),
     ('/search', Tweets),
     ('/refresh', Refresh),
+    ('/rehydrate', Rehydrate),
     ('/tasks/refresh', RefreshAll),
+    ('/tasks/compactcounters', CompactCounters),
+    ('/tasks/snapshotgraphs', SnapshotAllGraphs),
     ('/configure', Configure),
     ('/export', Exporter),
     ('/tweetretreiver', Retreiver),
+    ('/tweetrehydrator', Rehydrator),
+    ('/graphsnapshotter', GraphSnapshotter),
+    ('/tweetpurge', Purger),
     ('/tweetdeleter', Deleter),
     ], debug=True)
 
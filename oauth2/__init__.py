@@ -35,6 +35,11 @@ try:
 except ImportError:
     from cgi import parse_qs, parse_qsl
 
+try:
+    from hashlib import sha1 as sha
+except ImportError:
+    import sha # Deprecated
+
 
 VERSION = '1.0'  # Hi Blaine!
 HTTP_METHOD = 'GET'
@@ -93,12 +98,12 @@ def generate_timestamp():
 
 def generate_nonce(length=8):
     """Generate pseudorandom number."""
-    return ''.join([str(random.randint(0, 9)) for i in range(length)])
+    return '%0*d' % (length, random.randrange(10 ** length))
 
 
 def generate_verifier(length=8):
     """Generate pseudorandom number."""
-    return ''.join([str(random.randint(0, 9)) for i in range(length)])
+    return '%0*d' % (length, random.randrange(10 ** length))
 
 
 class Consumer(object):
@@ -278,7 +283,15 @@ class Request(dict):
     def url(self, value):
         self.__dict__['url'] = value
         if value is not None:
-            scheme, netloc, path, params, query, fragment = urlparse.urlparse(value)
+            self._url_parts = urlparse.urlparse(value)
+            scheme, netloc, path, params, query, fragment = self._url_parts
+
+            # The query string parameters are signed with the others, parse
+            # them once rather than on every signature.
+            if query:
+                self._url_params = self._split_url_string(query).items()
+            else:
+                self._url_params = []
 
             # Exclude default port numbers.
             if scheme == 'http' and netloc[-3:] == ':80':
@@ -292,6 +305,8 @@ class Request(dict):
             self.normalized_url = urlparse.urlunparse((scheme, netloc, path, None, None, None))
         else:
             self.normalized_url = None
+            self._url_parts = None
+            self._url_params = []
             self.__dict__['url'] = None
  
     @setter
@@ -329,7 +344,7 @@ class Request(dict):
  
     def to_url(self):
         """Serialize as a URL for a GET request."""
-        base_url = urlparse.urlparse(self.url)
+        base_url = self._url_parts
         query = parse_qs(base_url.query)
         for k, v in self.items():
             query.setdefault(k, []).append(v)
@@ -358,15 +373,17 @@ class Request(dict):
                 items.append((key, value))
 
         # Include any query string parameters from the provided URL
-        query = urlparse.urlparse(self.url)[4]
-        items.extend(self._split_url_string(query).items())
+        items.extend(self._url_params)
+        items.sort()
 
-        encoded_str = urllib.urlencode(sorted(items))
         # Encode signature parameters per Oauth Core 1.0 protocol
         # spec draft 7, section 3.6
         # (http://tools.ietf.org/html/draft-hammer-oauth-07#section-3.6)
-        # Spaces must be encoded with "%20" instead of "+"
-        return encoded_str.replace('+', '%20')
+        # Spaces must be encoded with "%20" instead of "+", quoting with
+        # no safe characters does that directly.
+        quote = urllib.quote
+        return '&'.join(['%s=%s' % (quote(str(k), ''), quote(str(v), ''))
+                         for k, v in items])
  
     def sign_request(self, signature_method, consumer, token):
         """Set the signature parameter to the result of sign."""
@@ -685,31 +702,46 @@ class SignatureMethod(object):
 
 class SignatureMethod_HMAC_SHA1(SignatureMethod):
     name = 'HMAC-SHA1'
-        
-    def signing_base(self, request, consumer, token):
+
+    # Most signing keys whose keyed HMAC is kept around.
+    max_keys = 100
+
+    def __init__(self):
+        self._hmacs = {}
+
+    def _signing_key(self, consumer, token):
+        key = '%s&' % escape(consumer.secret)
+        if token:
+            key += escape(token.secret)
+        return key
+
+    def _signing_message(self, request):
         sig = (
             escape(request.method),
             escape(request.normalized_url),
             escape(request.get_normalized_parameters()),
         )
+        return '&'.join(sig)
 
-        key = '%s&' % escape(consumer.secret)
-        if token:
-            key += escape(token.secret)
-        raw = '&'.join(sig)
-        return key, raw
+    def signing_base(self, request, consumer, token):
+        return (self._signing_key(consumer, token),
+                self._signing_message(request))
 
     def sign(self, request, consumer, token):
         """Builds the base signature string."""
         key, raw = self.signing_base(request, consumer, token)
 
-        # HMAC object.
-        try:
-            from hashlib import sha1 as sha
-        except ImportError:
-            import sha # Deprecated
-
-        hashed = hmac.new(key, raw, sha)
+        # Keying an HMAC object costs two hash updates, so keep one keyed
+        # with each signing key and sign with copies.
+        keyed = self._hmacs.get(key)
+        if keyed is None:
+            if len(self._hmacs) >= self.max_keys:
+                self._hmacs.clear()
+            keyed = hmac.new(key, None, sha)
+            self._hmacs[key] = keyed
+
+        hashed = keyed.copy()
+        hashed.update(raw)
 
         # Calculate the digest base 64.
         return binascii.b2a_base64(hashed.digest())[:-1]
@@ -0,0 +1,93 @@
+"""
+Times HMAC-SHA1 request signing the way twitter.Api does it.
+
+    python oauth2/benchmark.py [BASELINE]
+
+BASELINE is an optional path to another copy of oauth2/__init__.py,
+for instance the one from before the signing changes:
+
+    git show 341e430:oauth2/__init__.py > /tmp/oauth2_baseline.py
+    python oauth2/benchmark.py /tmp/oauth2_baseline.py
+
+Two things are timed on a user_timeline GET with five parameters and a
+query string: computing its HMAC-SHA1 signature alone, and building,
+signing and rendering the whole request URL.  The nonce and timestamp
+are fixed, so every copy of the module must produce the same URL; the
+script refuses to time copies that disagree.
+"""
+
+import imp
+import os
+import sys
+import timeit
+
+NUMBER = 20000
+REPEAT = 5
+
+URL = 'https://api.twitter.com/1/statuses/user_timeline.json?trim_user=1'
+
+PARAMETERS = {
+    'screen_name': 'tweetbak',
+    'count': '200',
+    'since_id': '12345678901',
+    'include_rts': 'true',
+    'oauth_nonce': '81529607',
+    'oauth_timestamp': '1287500000',
+}
+
+
+def load(name, path):
+    return imp.load_source(name, path)
+
+
+def make_runs(oauth):
+    consumer = oauth.Consumer(key='consumer-key', secret='consumer~secret')
+    token = oauth.Token(key='token-key', secret='token+secret')
+    method = oauth.SignatureMethod_HMAC_SHA1()
+
+    def request():
+        req = oauth.Request.from_consumer_and_token(consumer, token=token,
+            http_method='GET', http_url=URL, parameters=dict(PARAMETERS))
+        req.sign_request(method, consumer, token)
+        return req.to_url()
+
+    signed = oauth.Request.from_consumer_and_token(consumer, token=token,
+        http_method='GET', http_url=URL, parameters=dict(PARAMETERS))
+    signed['oauth_signature_method'] = method.name
+
+    def sign():
+        return method.sign(signed, consumer, token)
+    return sign, request
+
+
+def best(run):
+    return min(timeit.repeat(run, number=NUMBER, repeat=REPEAT)) / NUMBER
+
+
+def main(argv):
+    here = os.path.dirname(os.path.abspath(__file__))
+    # oauth2 imports httplib2, which sits next to it at the top level
+    sys.path.insert(0, os.path.dirname(here))
+    here = os.path.join(here, '__init__.py')
+    modules = [('current', load('oauth2_current', here))]
+    if len(argv) > 1:
+        modules.insert(0, ('baseline', load('oauth2_baseline', argv[1])))
+
+    runs = [(label, make_runs(oauth)) for label, oauth in modules]
+    urls = set([request() for label, (sign, request) in runs])
+    if len(urls) != 1:
+        for label, (sign, request) in runs:
+            print '%-10s %s' % (label, request())
+        print 'Signed URLs differ; not timing.'
+        return 1
+
+    print 'best of %d x %d runs, per call:' % (REPEAT, NUMBER)
+    print '  %-10s %10s %10s' % ('', 'sign', 'request')
+    for label, (sign, request) in runs:
+        print '  %-10s %7.1f us %7.1f us' % (label, best(sign) * 1e6,
+                                             best(request) * 1e6)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -99,7 +99,7 @@ Using simplejson.tool from the shell to validate and pretty-print::
 """
 __version__ = '2.1.2'
 __all__ = [
-    'dump', 'dumps', 'load', 'loads',
+    'dump', 'dumps', 'load', 'loads', 'iterload', 'iterloads',
     'JSONDecoder', 'JSONDecodeError', 'JSONEncoder',
     'OrderedDict',
 ]
@@ -401,6 +401,39 @@ def loads(s, encoding=None, cls=None, object_hook=None, parse_float=None,
     return cls(encoding=encoding, **kw).decode(s)
 
 
+def iterload(fp, cls=None, chunk_size=8192, **kw):
+    """Deserialize the JSON array read from ``fp`` (a ``.read()``-supporting
+    file-like object) one element at a time, returning an iterator over the
+    elements.
+
+    Only the element being decoded is held in memory, rather than the whole
+    document.  ``fp`` is read ``chunk_size`` characters at a time.
+
+    The other arguments have the same meaning as in :func:`load`.
+
+    """
+    if cls is None and not kw:
+        return _default_decoder.iterdecode(fp, chunk_size)
+    if cls is None:
+        cls = JSONDecoder
+    return cls(**kw).iterdecode(fp, chunk_size)
+
+
+def iterloads(s, cls=None, **kw):
+    """Deserialize the JSON array in ``s`` (a ``str`` or ``unicode``
+    instance) one element at a time, returning an iterator over the
+    elements.
+
+    The other arguments have the same meaning as in :func:`loads`.
+
+    """
+    if cls is None and not kw:
+        return _default_decoder.iterdecode(s)
+    if cls is None:
+        cls = JSONDecoder
+    return cls(**kw).iterdecode(s)
+
+
 def _toggle_speedups(enabled):
     import simplejson.decoder as dec
     import simplejson.encoder as enc
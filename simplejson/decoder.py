@@ -305,6 +305,13 @@ def JSONArray((s, end), scan_once, _w=WHITESPACE.match, _ws=WHITESPACE_STR):
 
     return values, end
 
+_ITER_EXPECTING = {
+    '[': "Expecting [",
+    'first': "Expecting object or ]",
+    ',': "Expecting , delimiter",
+    'value': "Expecting object",
+}
+
 class JSONDecoder(object):
     """Simple JSON <http://json.org> decoder
 
@@ -419,3 +426,77 @@ class JSONDecoder(object):
         except StopIteration:
             raise JSONDecodeError("No JSON object could be decoded", s, idx)
         return obj, end
+
+    def iterdecode(self, s, chunk_size=8192):
+        """Return an iterator over the elements of the JSON array in ``s``
+        (a ``str`` or ``unicode`` instance, or a file-like object that is
+        read ``chunk_size`` characters at a time).
+
+        Each element is decoded as soon as its text is available, so only
+        one element, plus whatever has been read past it, is held at once.
+
+        """
+        for obj, buf, start, end in self._iterdecode(s, chunk_size):
+            yield obj
+
+    def raw_iterdecode(self, s, chunk_size=8192):
+        """Like :meth:`iterdecode`, but yield a 2-tuple of each element's
+        Python representation and the text it was decoded from.
+
+        """
+        for obj, buf, start, end in self._iterdecode(s, chunk_size):
+            yield obj, buf[start:end]
+
+    def _iterdecode(self, s, chunk_size, _w=WHITESPACE.match):
+        # Yields (obj, buf, start, end) where buf[start:end] is the text of
+        # obj.  Data already decoded is dropped from buf on every refill.
+        if hasattr(s, 'read'):
+            read, buf, eof = s.read, s.read(0), False
+        else:
+            read, buf, eof = None, s, True
+        idx = 0
+        expecting = '['
+        while True:
+            idx = _w(buf, idx).end()
+            if idx == len(buf):
+                if not eof:
+                    chunk = read(chunk_size)
+                    buf, idx, eof = buf[idx:] + chunk, 0, not chunk
+                    continue
+                if expecting == 'end':
+                    return
+                raise JSONDecodeError(_ITER_EXPECTING[expecting], buf, idx)
+            nextchar = buf[idx]
+            if expecting == 'end':
+                raise JSONDecodeError("Extra data", buf, idx, len(buf))
+            elif expecting == '[':
+                if nextchar != '[':
+                    raise JSONDecodeError("Expecting [", buf, idx)
+                idx += 1
+                expecting = 'first'
+            elif expecting in ('first', ',') and nextchar == ']':
+                idx += 1
+                expecting = 'end'
+            elif expecting == ',':
+                if nextchar != ',':
+                    raise JSONDecodeError("Expecting , delimiter", buf, idx)
+                idx += 1
+                expecting = 'value'
+            else:
+                # A value may be cut off at the end of the buffer, only
+                # trust it once something follows it or there is no more
+                try:
+                    obj, end = self.scan_once(buf, idx)
+                    complete = eof or end < len(buf)
+                except (StopIteration, JSONDecodeError):
+                    if eof:
+                        self.raw_decode(buf, idx)
+                        raise
+                    complete = False
+                if not complete:
+                    chunk = read(chunk_size)
+                    buf, idx, eof = buf[idx:] + chunk, 0, not chunk
+                    continue
+                yield obj, buf, idx, end
+                idx = end
+                expecting = ','
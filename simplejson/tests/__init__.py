@@ -36,6 +36,7 @@ def all_tests_suite():
         'simplejson.tests.test_errors',
         'simplejson.tests.test_fail',
         'simplejson.tests.test_float',
+        'simplejson.tests.test_iterdecode',
         'simplejson.tests.test_indent',
         'simplejson.tests.test_pass1',
         'simplejson.tests.test_pass2',
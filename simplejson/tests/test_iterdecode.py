@@ -0,0 +1,49 @@
+from unittest import TestCase
+from StringIO import StringIO
+
+import simplejson as json
+
+
+class TestIterDecode(TestCase):
+    DOC = ' [ {"a": [1, 2]}, "x,]", 12345 ,[], null, {"b": {"c": "\\u00e9"}} ] '
+
+    def expected(self):
+        return json.loads(self.DOC)
+
+    def test_iterloads(self):
+        self.assertEquals(list(json.iterloads(self.DOC)), self.expected())
+
+    def test_iterload_chunks(self):
+        for chunk_size in (1, 2, 3, 7, 8192):
+            self.assertEquals(
+                list(json.iterload(StringIO(self.DOC), chunk_size=chunk_size)),
+                self.expected())
+
+    def test_iterload_is_lazy(self):
+        fp = StringIO('[1, 2, ' + ' ' * 100 + '3]')
+        it = json.iterload(fp, chunk_size=4)
+        self.assertEquals(it.next(), 1)
+        self.assertTrue(fp.tell() < 20)
+
+    def test_empty(self):
+        self.assertEquals(list(json.iterloads('[]')), [])
+        self.assertEquals(list(json.iterload(StringIO(' [ ] '), chunk_size=1)), [])
+
+    def test_raw_iterdecode(self):
+        decoder = json.JSONDecoder()
+        for source in (self.DOC, StringIO(self.DOC)):
+            pairs = list(decoder.raw_iterdecode(source, chunk_size=3))
+            self.assertEquals([obj for obj, raw in pairs], self.expected())
+            self.assertEquals([json.loads(raw) for obj, raw in pairs],
+                              self.expected())
+            self.assertEquals(pairs[2][1], '12345')
+
+    def test_kwargs(self):
+        rval = list(json.iterloads('[1.5, 2]', parse_float=str))
+        self.assertEquals(rval, ['1.5', 2])
+
+    def test_errors(self):
+        for doc in ('', '{"a": 1}', '[1, 2', '[1 2]', '[1,]', '[1] 2', '["abc'):
+            self.assertRaises(json.JSONDecodeError, list, json.iterloads(doc))
+            self.assertRaises(json.JSONDecodeError, list,
+                              json.iterload(StringIO(doc), chunk_size=2))
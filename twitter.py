@@ -25,17 +25,20 @@ import calendar
 import datetime
 import httplib
 import os
+import Queue
+import random
 import rfc822
+import socket
 import sys
 import tempfile
 import textwrap
+import threading
 import time
 import calendar
 import urllib
-import urllib2
 import urlparse
-import gzip
-import StringIO
+import warnings
+import httplib2
 
 try:
   # Python >= 2.6
@@ -51,6 +54,13 @@ except ImportError:
     except ImportError:
       raise ImportError, "Unable to load a json library"
 
+try:
+  # The bundled simplejson can decode a JSON array one element at a time
+  from simplejson import JSONDecoder as _JSONDecoder
+  _raw_iterdecode = _JSONDecoder().raw_iterdecode
+except (ImportError, AttributeError):
+  _raw_iterdecode = None
+
 # parse_qsl moved to urlparse module in v2.6
 try:
   from urlparse import parse_qsl, parse_qs
@@ -62,12 +72,25 @@ try:
 except ImportError:
   from md5 import md5
 
+try:
+  # Python >= 2.5, not available on Google App Engine
+  import sqlite3
+except ImportError:
+  sqlite3 = None
+
+try:
+  # Google App Engine
+  from google.appengine.api import memcache
+except ImportError:
+  memcache = None
+
 import oauth2 as oauth
 
 
 CHARACTER_LIMIT = 140
 
-# A singleton representing a lazily instantiated FileCache.
+# A singleton representing a lazily instantiated TieredCache, or a
+# FileCache where sqlite3 is not available.
 DEFAULT_CACHE = object()
 
 REQUEST_TOKEN_URL = 'https://api.twitter.com/oauth/request_token'
@@ -85,7 +108,78 @@ class TwitterError(Exception):
     return self.args[0]
 
 
-class Status(object):
+class _UnauthorizedError(TwitterError):
+  '''Raised when twitter rejects the credentials of a request.'''
+
+
+class _JsonObject(object):
+  '''Base class for API objects backed by their decoded JSON dict.
+
+  NewFromJsonDict only keeps a reference to the dict.  Each field lives
+  in a slot and is built from the dict by its loader in _LAZY_FIELDS the
+  first time it is read, so nested objects nobody looks at are never
+  created.
+  '''
+  __slots__ = ('_data',)
+
+  _LAZY_FIELDS = {}
+
+  def __getattr__(self, name):
+    # Only reached for slots that have not been filled in yet
+    try:
+      loader = self._LAZY_FIELDS[name]
+    except KeyError:
+      raise AttributeError(name)
+    try:
+      data = object.__getattribute__(self, '_data')
+    except AttributeError:
+      data = None
+    if data is None:
+      value = None
+    else:
+      value = loader(data)
+    object.__setattr__(self, name, value)
+    return value
+
+  def __getstate__(self):
+    # Slots have no __dict__ to pickle, so hand over the filled ones.
+    # Fields not read yet are left out and still load from _data later.
+    state = {}
+    for cls in type(self).__mro__:
+      for name in cls.__dict__.get('__slots__', ()):
+        try:
+          state[name] = object.__getattribute__(self, name)
+        except AttributeError:
+          pass
+    return state
+
+  def __setstate__(self, state):
+    for name, value in state.items():
+      object.__setattr__(self, name, value)
+
+
+def _JsonFields(slots, **loaders):
+  '''Map each slot to a loader reading the JSON key of the same name.
+
+  A leading underscore is dropped from the slot name to find the key.
+  Loaders passed by keyword replace the default for that slot.
+  '''
+  fields = {}
+  for slot in slots:
+    fields[slot] = lambda data, key=slot.lstrip('_'): data.get(key, None)
+  fields.update(loaders)
+  return fields
+
+
+def _JsonEntities(data, key, cls):
+  '''Build a list of cls instances from data['entities'][key], if any.'''
+  entities = data.get('entities', None)
+  if entities and key in entities:
+    return [cls.NewFromJsonDict(x) for x in entities[key]]
+  return None
+
+
+class Status(_JsonObject):
   '''A class representing the Status structure used by the twitter API.
   
   The Status structure exposes the following properties:
@@ -111,6 +205,22 @@ class Status(object):
     status.coordinates
     status.contributors
   '''
+  __slots__ = ('_created_at', '_favorited', '_id', '_text', '_location',
+               '_user', '_now', '_in_reply_to_screen_name',
+               '_in_reply_to_user_id', '_in_reply_to_status_id',
+               '_truncated', '_source', '_geo', '_place', '_coordinates',
+               '_contributors', '_raw_json', 'urls', 'user_mentions',
+               'hashtags')
+
+  _LAZY_FIELDS = _JsonFields(
+      __slots__,
+      _now=lambda data: None,
+      _raw_json=lambda data: simplejson.dumps(data, separators=(',', ':')),
+      _user=lambda data: 'user' in data and User.NewFromJsonDict(data['user']) or None,
+      urls=lambda data: _JsonEntities(data, 'urls', Url),
+      user_mentions=lambda data: _JsonEntities(data, 'user_mentions', User),
+      hashtags=lambda data: _JsonEntities(data, 'hashtags', Hashtag))
+
   def __init__(self,
                created_at=None,
                favorited=None,
@@ -158,6 +268,7 @@ class Status(object):
         The current time, if the client choses to set it.
         Defaults to the wall clock time. [Optional]
     '''
+    self._data = None
     self.created_at = created_at
     self.favorited = favorited
     self.id = id
@@ -451,6 +562,24 @@ class Status(object):
   contributors = property(GetContributors, SetContributors,
                           doc='')
 
+  def GetRawJson(self):
+    '''Get the JSON for this status message as it was received.
+
+    Unlike AsJsonString, this keeps every field twitter sent, entities
+    included, and ignores any changes made through the setters.
+
+    Returns:
+      The original JSON string for this status message, or the output
+      of AsJsonString if the status was not created from JSON.
+    '''
+    if self._raw_json is None:
+      return self.AsJsonString()
+    return self._raw_json
+
+  raw_json = property(GetRawJson,
+                      doc='The JSON for this status message as it was '
+                          'received')
+
   def __ne__(self, other):
     return not self.__eq__(other)
 
@@ -537,49 +666,25 @@ class Status(object):
     return data
 
   @staticmethod
-  def NewFromJsonDict(data):
+  def NewFromJsonDict(data, raw_json=None):
     '''Create a new instance based on a JSON dict.
 
     Args:
       data: A JSON dict, as converted from the JSON in the twitter API
+      raw_json:
+        The JSON string data was decoded from.  If not given it is
+        encoded again from data the first time raw_json is read. [Optional]
     Returns:
       A twitter.Status instance
     '''
-    if 'user' in data:
-      user = User.NewFromJsonDict(data['user'])
-    else:
-      user = None
-    urls = None
-    user_mentions = None
-    hashtags = None
-    if 'entities' in data:
-      if 'urls' in data['entities']:
-        urls = [Url.NewFromJsonDict(u) for u in data['entities']['urls']]
-      if 'user_mentions' in data['entities']:
-        user_mentions = [User.NewFromJsonDict(u) for u in data['entities']['user_mentions']]
-      if 'hashtags' in data['entities']:
-        hashtags = [Hashtag.NewFromJsonDict(h) for h in data['entities']['hashtags']]
-    return Status(created_at=data.get('created_at', None),
-                  favorited=data.get('favorited', None),
-                  id=data.get('id', None),
-                  text=data.get('text', None),
-                  location=data.get('location', None),
-                  in_reply_to_screen_name=data.get('in_reply_to_screen_name', None),
-                  in_reply_to_user_id=data.get('in_reply_to_user_id', None),
-                  in_reply_to_status_id=data.get('in_reply_to_status_id', None),
-                  truncated=data.get('truncated', None),
-                  source=data.get('source', None),
-                  user=user,
-                  urls=urls,
-                  user_mentions=user_mentions,
-                  hashtags=hashtags,
-                  geo=data.get('geo', None),
-                  place=data.get('place', None),
-                  coordinates=data.get('coordinates', None),
-                  contributors=data.get('contributors', None))
-
-
-class User(object):
+    status = Status.__new__(Status)
+    status._data = data
+    if raw_json is not None:
+      status._raw_json = raw_json
+    return status
+
+
+class User(_JsonObject):
   '''A class representing the User structure used by the twitter API.
 
   The User structure exposes the following properties:
@@ -607,6 +712,19 @@ class User(object):
     user.favourites_count
     user.geo_enabled
   '''
+  __slots__ = ('_id', '_name', '_screen_name', '_location', '_description',
+               '_profile_image_url', '_profile_background_tile',
+               '_profile_background_image_url',
+               '_profile_sidebar_fill_color', '_profile_background_color',
+               '_profile_link_color', '_profile_text_color', '_protected',
+               '_utc_offset', '_time_zone', '_followers_count',
+               '_friends_count', '_statuses_count', '_favourites_count',
+               '_url', '_status', '_geo_enabled')
+
+  _LAZY_FIELDS = _JsonFields(
+      __slots__,
+      _status=lambda data: 'status' in data and Status.NewFromJsonDict(data['status']) or None)
+
   def __init__(self,
                id=None,
                name=None,
@@ -630,6 +748,7 @@ class User(object):
                url=None,
                status=None,
                geo_enabled=None):
+    self._data = None
     self.id = id
     self.name = name
     self.screen_name = screen_name
@@ -1114,32 +1233,10 @@ class User(object):
     Returns:
       A twitter.User instance
     '''
-    if 'status' in data:
-      status = Status.NewFromJsonDict(data['status'])
-    else:
-      status = None
-    return User(id=data.get('id', None),
-                name=data.get('name', None),
-                screen_name=data.get('screen_name', None),
-                location=data.get('location', None),
-                description=data.get('description', None),
-                statuses_count=data.get('statuses_count', None),
-                followers_count=data.get('followers_count', None),
-                favourites_count=data.get('favourites_count', None),
-                friends_count=data.get('friends_count', None),
-                profile_image_url=data.get('profile_image_url', None),
-                profile_background_tile = data.get('profile_background_tile', None),
-                profile_background_image_url = data.get('profile_background_image_url', None),
-                profile_sidebar_fill_color = data.get('profile_sidebar_fill_color', None),
-                profile_background_color = data.get('profile_background_color', None),
-                profile_link_color = data.get('profile_link_color', None),
-                profile_text_color = data.get('profile_text_color', None),
-                protected = data.get('protected', None),
-                utc_offset = data.get('utc_offset', None),
-                time_zone = data.get('time_zone', None),
-                url=data.get('url', None),
-                status=status,
-                geo_enabled=data.get('geo_enabled', None))
+    user = User.__new__(User)
+    user._data = data
+    return user
+
 
 class List(object):
   '''A class representing the List structure used by the twitter API.
@@ -1784,11 +1881,16 @@ class DirectMessage(object):
                          id=data.get('id', None),
                          recipient_screen_name=data.get('recipient_screen_name', None))
 
-class Hashtag(object):
+class Hashtag(_JsonObject):
   ''' A class represeinting a twitter hashtag
   '''
+  __slots__ = ('text',)
+
+  _LAZY_FIELDS = _JsonFields(__slots__)
+
   def __init__(self,
                text=None):
+    self._data = None
     self.text = text
 
   @staticmethod
@@ -1802,7 +1904,9 @@ class Hashtag(object):
     Returns:
       A twitter.Hashtag instance
     '''
-    return Hashtag(text = data.get('text', None))
+    hashtag = Hashtag.__new__(Hashtag)
+    hashtag._data = data
+    return hashtag
 
 class Trend(object):
   ''' A class representing a trending topic
@@ -1832,11 +1936,16 @@ class Trend(object):
                  query=data.get('query', None),
                  timestamp=timestamp)
 
-class Url(object):
+class Url(_JsonObject):
   '''A class representing an URL contained in a tweet'''
+  __slots__ = ('url', 'expanded_url')
+
+  _LAZY_FIELDS = _JsonFields(__slots__)
+
   def __init__(self,
                url=None,
                expanded_url=None):
+    self._data = None
     self.url = url
     self.expanded_url = expanded_url
 
@@ -1851,8 +1960,9 @@ class Url(object):
     Returns:
       A twitter.Url instance
     '''
-    return Url(url=data.get('url', None),
-               expanded_url=data.get('expanded_url', None))
+    url = Url.__new__(Url)
+    url._data = data
+    return url
 
 class Api(object):
   '''A python interface into the Twitter API
@@ -1920,6 +2030,24 @@ class Api(object):
   '''
 
   DEFAULT_CACHE_TIMEOUT = 60 # cache for 1 minute
+  DEFAULT_MAX_WORKERS = 4 # concurrent requests for bulk calls
+  DEFAULT_MAX_CONNECTIONS = 16 # keep-alive connections per host
+  MAX_LOOKUP_USERS = 100 # users per users/lookup call
+  MAX_LOOKUP_STATUSES = 100 # statuses per statuses/lookup call
+  DEFAULT_USER_CACHE_SIZE = 10000 # users remembered by HydrateUsers
+  DEFAULT_USER_CACHE_TIMEOUT = 60 * 60 # seconds a remembered user is reused
+  DEFAULT_MAX_RETRIES = 3 # retries of a GET after a transient failure
+  RETRY_BACKOFF = 0.5 # seconds, doubled on every retry
+  RETRY_BACKOFF_CAP = 30 # longest wait between two retries, in seconds
+  RETRY_DEADLINE = 10 # seconds after which a GET is no longer retried
+  CIRCUIT_FAILURES = 5 # consecutive failures before a host is cut off
+  CIRCUIT_COOLDOWN = 60 # seconds a host stays cut off
+  TRANSIENT_STATUSES = (500, 502, 503, 504)
+  TRANSIENT_ERRORS = (socket.error, httplib.HTTPException,
+                      httplib2.ServerNotFoundError)
+  _in_flight = None # shared by all instances, set once _SingleFlight exists
+  _circuits = {} # host -> _CircuitBreaker, shared by all instances
+  _circuits_lock = threading.Lock()
   _API_REALM = 'Twitter API'
 
   def __init__(self,
@@ -1932,7 +2060,7 @@ class Api(object):
                cache=DEFAULT_CACHE,
                shortner=None,
                base_url=None,
-               use_gzip_compression=False,
+               use_gzip_compression=True,
                debugHTTP=False):
     '''Instantiate a new twitter.Api object.
 
@@ -1961,15 +2089,19 @@ class Api(object):
         The base URL to use to contact the Twitter API.
         Defaults to https://twitter.com. [Optional]
       use_gzip_compression:
-        Set to True to tell enable gzip compression for any call
-        made to Twitter.  Defaults to False. [Optional]
+        Set to False to disable gzip compression for calls
+        made to Twitter.  Defaults to True. [Optional]
       debugHTTP:
-        Set to True to enable debug output from urllib2 when performing
+        Set to True to enable debug output from httplib2 when performing
         any HTTP requests.  Defaults to False. [Optional]
     '''
     self.SetCache(cache)
-    self._urllib         = urllib2
+    self.SetHttp(None)
     self._cache_timeout  = Api.DEFAULT_CACHE_TIMEOUT
+    self._max_retries    = Api.DEFAULT_MAX_RETRIES
+    self._retry_deadline = Api.RETRY_DEADLINE
+    self._user_cache     = MemoryCache(max_entries=Api.DEFAULT_USER_CACHE_SIZE,
+                                       timeout=Api.DEFAULT_USER_CACHE_TIMEOUT)
     self._input_encoding = input_encoding
     self._use_gzip       = use_gzip_compression
     self._debugHTTP      = debugHTTP
@@ -2071,12 +2203,8 @@ class Api(object):
       parameters['include_entities'] = 1
 
     url  = '%s/statuses/public_timeline.json' % self.base_url
-    json = self._FetchUrl(url,  parameters=parameters)
-    data = simplejson.loads(json)
-
-    self._CheckForTwitterError(data)
-
-    return [Status.NewFromJsonDict(x) for x in data]
+    json = self._FetchUrl(url,  parameters=parameters, stream=True)
+    return self._ParseStatuses(json)
 
   def FilterPublicTimeline(self,
                            term,
@@ -2354,10 +2482,8 @@ class Api(object):
       parameters['include_rts'] = True
     if include_entities:
       parameters['include_entities'] = True
-    json = self._FetchUrl(url, parameters=parameters)
-    data = simplejson.loads(json)
-    self._CheckForTwitterError(data)
-    return [Status.NewFromJsonDict(x) for x in data]
+    json = self._FetchUrl(url, parameters=parameters, stream=True)
+    return self._ParseStatuses(json)
 
   def GetUserTimeline(self,
                       id=None,
@@ -2460,10 +2586,132 @@ class Api(object):
     if trim_user:
       parameters['trim_user'] = 1
 
-    json = self._FetchUrl(url, parameters=parameters)
-    data = simplejson.loads(json)
-    self._CheckForTwitterError(data)
-    return [Status.NewFromJsonDict(x) for x in data]
+    json = self._FetchUrl(url, parameters=parameters, stream=True)
+    return self._ParseStatuses(json)
+
+  def GetUserTimelines(self, users, max_workers=None, **kwargs):
+    '''Fetch the public Status messages for many users concurrently.
+
+    Timelines are fetched on a pool of threads sharing this instance's
+    connection pool, so at most max_workers requests are in flight at once.
+
+    Args:
+      users:
+        A sequence of user IDs or screen names, or of (user, since_id)
+        pairs to fetch only the messages newer than since_id.
+      max_workers:
+        The maximum number of timelines to fetch at the same time.
+        Defaults to Api.DEFAULT_MAX_WORKERS. [Optional]
+      **kwargs:
+        Any other GetUserTimeline argument, such as count or
+        include_rts, applied to every user. [Optional]
+
+    Returns:
+      A list with one (statuses, error) tuple per user, in the order
+      the users were given.  statuses is the sequence of Status
+      instances, or None if fetching that timeline raised error.
+    '''
+    if max_workers is None:
+      max_workers = Api.DEFAULT_MAX_WORKERS
+
+    default_since_id = kwargs.pop('since_id', None)
+    jobs = Queue.Queue()
+    for index, user in enumerate(users):
+      if isinstance(user, tuple):
+        jobs.put((index, user[0], user[1]))
+      else:
+        jobs.put((index, user, default_since_id))
+    results = [None] * jobs.qsize()
+
+    def worker():
+      while True:
+        try:
+          index, user, since_id = jobs.get_nowait()
+        except Queue.Empty:
+          return
+        try:
+          statuses = self.GetUserTimeline(user, since_id=since_id, **kwargs)
+          results[index] = (statuses, None)
+        except Exception, e:
+          results[index] = (None, e)
+
+    threads = [threading.Thread(target=worker)
+               for i in range(min(max_workers, len(results)))]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    return results
+
+  def IterUserTimeline(self,
+                       id=None,
+                       user_id=None,
+                       screen_name=None,
+                       since_id=None,
+                       max_id=None,
+                       count=200,
+                       limit=None,
+                       prefetch=True,
+                       **kwargs):
+    '''Iterate over the public Status messages for a single user.
+
+    The timeline is walked newest first, one page of count statuses at
+    a time, by passing the lowest ID seen so far as the next max_id.
+    Only about one page is held in memory.  With prefetch set, the next
+    page is requested in the background while the caller processes the
+    current one.
+
+    Args:
+      id, user_id, screen_name:
+        The user whose timeline to walk, as for GetUserTimeline.
+      since_id:
+        Stop once the timeline reaches this ID. [Optional]
+      max_id:
+        Start from this ID rather than the newest status. [Optional]
+      count:
+        The number of statuses to request per page. May not be
+        greater than 200. [Optional]
+      limit:
+        Stop after yielding this many statuses. [Optional]
+      prefetch:
+        If True, fetch the next page while the current one is being
+        consumed.  Defaults to True. [Optional]
+      **kwargs:
+        Any other GetUserTimeline argument, such as include_rts or
+        trim_user, applied to every page. [Optional]
+
+    Returns:
+      A generator of Status instances, newest first.
+    '''
+    def fetch(max_id):
+      return self.GetUserTimeline(id=id, user_id=user_id,
+                                  screen_name=screen_name,
+                                  since_id=since_id, max_id=max_id,
+                                  count=count, **kwargs)
+
+    def start(max_id):
+      if prefetch:
+        return _BackgroundCall(fetch, max_id).Get
+      return lambda: fetch(max_id)
+
+    yielded = 0
+    pending = start(max_id)
+    while pending:
+      statuses = pending()
+      if not statuses:
+        return
+      next_max_id = min([s.id for s in statuses]) - 1
+      if next_max_id > 0 and (limit is None or yielded + len(statuses) < limit):
+        pending = start(next_max_id)
+      else:
+        pending = None
+      for status in statuses:
+        if since_id and status.id <= long(since_id):
+          return
+        yield status
+        yielded += 1
+        if limit is not None and yielded >= limit:
+          return
 
   def GetStatus(self, id):
     '''Returns a single status message.
@@ -2489,6 +2737,48 @@ class Api(object):
     self._CheckForTwitterError(data)
     return Status.NewFromJsonDict(data)
 
+  def StatusesLookup(self, ids, trim_user=False):
+    '''Fetch up to Api.MAX_LOOKUP_STATUSES status messages in one call.
+
+    The twitter.Api instance must be authenticated if any of the
+    status messages are private.
+
+    Args:
+      ids:
+        A list of the numeric IDs of the statuses to retrieve.
+      trim_user:
+        If True the user of each status only carries its ID.
+        [Optional]
+
+    Returns:
+      A dict mapping each requested ID, as a long, to a twitter.Status
+      instance, or to None if the status was deleted or is not visible
+    '''
+    try:
+      ids = [long(id) for id in ids]
+    except:
+      raise TwitterError("ids must be long integers")
+    if not ids:
+      raise TwitterError("Specify at least one status id.")
+    if len(ids) > Api.MAX_LOOKUP_STATUSES:
+      raise TwitterError("Specify at most %d status ids." %
+                         Api.MAX_LOOKUP_STATUSES)
+    url = '%s/statuses/lookup.json' % self.base_url
+    parameters = {}
+    parameters['id'] = ','.join(["%s" % id for id in ids])
+    # map=true returns missing statuses as nulls rather than leaving them out
+    parameters['map'] = 'true'
+    if trim_user:
+      parameters['trim_user'] = 1
+    json = self._FetchUrl(url, parameters=parameters)
+    data = simplejson.loads(json)
+    self._CheckForTwitterError(data)
+    statuses = dict.fromkeys(ids)
+    for id, status in data.get('id', {}).items():
+      if status:
+        statuses[long(id)] = Status.NewFromJsonDict(status)
+    return statuses
+
   def DestroyStatus(self, id):
     '''Destroys the status specified by the required ID parameter.
 
@@ -2628,10 +2918,8 @@ class Api(object):
        parameters['since_id'] = since_id
      if include_entities:
        parameters['include_entities'] = True
-     json = self._FetchUrl(url, parameters=parameters)
-     data = simplejson.loads(json)
-     self._CheckForTwitterError(data)
-     return [Status.NewFromJsonDict(x) for x in data]
+     json = self._FetchUrl(url, parameters=parameters, stream=True)
+     return self._ParseStatuses(json)
 
   def GetReplies(self, since=None, since_id=None, page=None):
     '''Get a sequence of status messages representing the 20 most
@@ -2663,10 +2951,8 @@ class Api(object):
       parameters['since_id'] = since_id
     if page:
       parameters['page'] = page
-    json = self._FetchUrl(url, parameters=parameters)
-    data = simplejson.loads(json)
-    self._CheckForTwitterError(data)
-    return [Status.NewFromJsonDict(x) for x in data]
+    json = self._FetchUrl(url, parameters=parameters, stream=True)
+    return self._ParseStatuses(json)
 
   def GetRetweets(self, statusid):
     '''Returns up to 100 of the first retweets of the tweet identified
@@ -2683,10 +2969,8 @@ class Api(object):
       raise TwitterError("The twitter.Api instsance must be authenticated.")
     url = '%s/statuses/retweets/%s.json?include_entities=true&include_rts=true' % (self.base_url, statusid)
     parameters = {}
-    json = self._FetchUrl(url, parameters=parameters)
-    data = simplejson.loads(json)
-    self._CheckForTwitterError(data)
-    return [Status.NewFromJsonDict(s) for s in data]
+    json = self._FetchUrl(url, parameters=parameters, stream=True)
+    return self._ParseStatuses(json)
 
   def GetFriends(self, user=None, cursor=-1):
     '''Fetch the sequence of twitter.User instances, one for each friend.
@@ -2839,6 +3123,203 @@ class Api(object):
     self._CheckForTwitterError(data)
     return [User.NewFromJsonDict(u) for u in data]
 
+  def HydrateUsers(self, user_ids, max_workers=None):
+    '''Fetch extended information for any number of users by ID.
+
+    The IDs are read lazily and looked up Api.MAX_LOOKUP_USERS at a time
+    through UsersLookup, with up to max_workers lookups in flight.
+    A max_workers of 1 makes every lookup on the calling thread.
+    Users looked up recently are remembered and not asked for again.
+
+    The twitter.Api instance must be authenticated.
+
+    Args:
+      user_ids:
+        An iterable of user IDs, such as the one IterFollowerIDs returns.
+      max_workers:
+        The maximum number of lookups to make at the same time.
+        Defaults to Api.DEFAULT_MAX_WORKERS. [Optional]
+
+    Returns:
+      A generator of twitter.User instances, in the order of user_ids.
+      Users that no longer exist are left out.
+    '''
+    if max_workers is None:
+      max_workers = Api.DEFAULT_MAX_WORKERS
+
+    def lookup(batch):
+      users = {}
+      missing = []
+      for user_id in batch:
+        user = self._user_cache.Get(user_id)
+        if user is None:
+          missing.append(user_id)
+        else:
+          users[user_id] = user
+      if missing:
+        for user in self.UsersLookup(user_id=missing):
+          self._user_cache.Set(user.id, user)
+          users[user.id] = user
+      return [users[user_id] for user_id in batch if user_id in users]
+
+    pending = []
+    exhausted = False
+    user_ids = iter(user_ids)
+    while pending or not exhausted:
+      if not exhausted:
+        batch = []
+        for user_id in user_ids:
+          batch.append(long(user_id))
+          if len(batch) == Api.MAX_LOOKUP_USERS:
+            break
+        else:
+          exhausted = True
+        if batch and max_workers <= 1:
+          for user in lookup(batch):
+            yield user
+        elif batch:
+          pending.append(_BackgroundCall(lookup, batch))
+      # Hand back the oldest batch once enough lookups are in flight, or
+      # once there are no more IDs to look up
+      if pending and (exhausted or len(pending) >= max_workers):
+        for user in pending.pop(0).Get():
+          yield user
+
+  def HydrateStatuses(self, status_ids, max_workers=None, trim_user=False):
+    '''Fetch any number of status messages by ID.
+
+    The IDs are read lazily and looked up Api.MAX_LOOKUP_STATUSES at a
+    time through StatusesLookup, with up to max_workers lookups in flight.
+    A max_workers of 1 makes every lookup on the calling thread.
+
+    Args:
+      status_ids:
+        An iterable of status IDs, such as archived Status.id values.
+      max_workers:
+        The maximum number of lookups to make at the same time.
+        Defaults to Api.DEFAULT_MAX_WORKERS. [Optional]
+      trim_user:
+        If True the user of each status only carries its ID.
+        [Optional]
+
+    Returns:
+      A generator of (status ID, twitter.Status) pairs, in the order of
+      status_ids.  The status is None for IDs that were deleted or are
+      not visible.
+    '''
+    if max_workers is None:
+      max_workers = Api.DEFAULT_MAX_WORKERS
+
+    def lookup(batch):
+      statuses = self.StatusesLookup(batch, trim_user=trim_user)
+      return [(status_id, statuses[status_id]) for status_id in batch]
+
+    pending = []
+    exhausted = False
+    status_ids = iter(status_ids)
+    while pending or not exhausted:
+      if not exhausted:
+        batch = []
+        for status_id in status_ids:
+          batch.append(long(status_id))
+          if len(batch) == Api.MAX_LOOKUP_STATUSES:
+            break
+        else:
+          exhausted = True
+        if batch and max_workers <= 1:
+          for pair in lookup(batch):
+            yield pair
+        elif batch:
+          pending.append(_BackgroundCall(lookup, batch))
+      if pending and (exhausted or len(pending) >= max_workers):
+        for pair in pending.pop(0).Get():
+          yield pair
+
+  def IterFollowerIDs(self, userid=None):
+    '''Iterate over the IDs of a user's followers.
+
+    The cursored pages of GetFollowerIDs are fetched as the IDs are
+    consumed.
+
+    Args:
+      userid:
+        The ID of the user whose followers to list.  Defaults to the
+        authenticated user. [Optional]
+
+    Returns:
+      A generator of user IDs.
+    '''
+    return self._IterCursor(lambda cursor:
+                            self.GetFollowerIDs(userid=userid, cursor=cursor))
+
+  def IterFriendIDs(self, user=None):
+    '''Iterate over the IDs of the users a user is following.
+
+    The cursored pages of GetFriendIDs are fetched as the IDs are
+    consumed.
+
+    Args:
+      user:
+        The ID or screen_name of the user whose friends to list.
+        Defaults to the authenticated user. [Optional]
+
+    Returns:
+      A generator of user IDs.
+    '''
+    return self._IterCursor(lambda cursor:
+                            self.GetFriendIDs(user=user, cursor=cursor))
+
+  def IterFollowers(self, userid=None, max_workers=None):
+    '''Iterate over a user's followers as twitter.User instances.
+
+    Combines IterFollowerIDs and HydrateUsers, so a hundred followers
+    cost one call.
+
+    Args:
+      userid:
+        The ID of the user whose followers to list.  Defaults to the
+        authenticated user. [Optional]
+      max_workers:
+        The maximum number of lookups to make at the same time.
+        Defaults to Api.DEFAULT_MAX_WORKERS. [Optional]
+
+    Returns:
+      A generator of twitter.User instances.
+    '''
+    return self.HydrateUsers(self.IterFollowerIDs(userid), max_workers)
+
+  def IterFriends(self, user=None, max_workers=None):
+    '''Iterate over the users a user is following as twitter.User instances.
+
+    Combines IterFriendIDs and HydrateUsers, so a hundred friends cost
+    one call.
+
+    Args:
+      user:
+        The ID or screen_name of the user whose friends to list.
+        Defaults to the authenticated user. [Optional]
+      max_workers:
+        The maximum number of lookups to make at the same time.
+        Defaults to Api.DEFAULT_MAX_WORKERS. [Optional]
+
+    Returns:
+      A generator of twitter.User instances.
+    '''
+    return self.HydrateUsers(self.IterFriendIDs(user), max_workers)
+
+  def _IterCursor(self, fetch):
+    '''Yield the IDs of every page of a cursored call.'''
+    cursor = -1
+    while cursor:
+      data = fetch(cursor)
+      if isinstance(data, list):
+        # Not a cursored response, all the IDs came in one go
+        ids, cursor = data, 0
+      else:
+        ids, cursor = data.get('ids', []), data.get('next_cursor', 0)
+      for user_id in ids:
+        yield user_id
+
   def GetUser(self, user):
     '''Returns a single user.
 
@@ -3026,12 +3507,8 @@ class Api(object):
     else:
       url = '%s/favorites.json' % self.base_url
 
-    json = self._FetchUrl(url, parameters=parameters)
-    data = simplejson.loads(json)
-
-    self._CheckForTwitterError(data)
-
-    return [Status.NewFromJsonDict(x) for x in data]
+    json = self._FetchUrl(url, parameters=parameters, stream=True)
+    return self._ParseStatuses(json)
 
   def GetMentions(self,
                   since_id=None,
@@ -3072,12 +3549,8 @@ class Api(object):
     if page:
       parameters['page'] = page
 
-    json = self._FetchUrl(url, parameters=parameters)
-    data = simplejson.loads(json)
-
-    self._CheckForTwitterError(data)
-
-    return [Status.NewFromJsonDict(x) for x in data]
+    json = self._FetchUrl(url, parameters=parameters, stream=True)
+    return self._ParseStatuses(json)
 
   def CreateList(self, user, name, mode=None, description=None):
     '''Creates a new list with the give name
@@ -3258,11 +3731,8 @@ class Api(object):
     url = '%s/account/verify_credentials.json' % self.base_url
     try:
       json = self._FetchUrl(url, no_cache=True)
-    except urllib2.HTTPError, http_error:
-      if http_error.code == httplib.UNAUTHORIZED:
-        return None
-      else:
-        raise http_error
+    except _UnauthorizedError:
+      return None
     data = simplejson.loads(json)
     self._CheckForTwitterError(data)
     return User.NewFromJsonDict(data)
@@ -3272,21 +3742,43 @@ class Api(object):
 
     Args:
       cache:
-        An instance that supports the same API as the twitter._FileCache
+        An instance that supports the same API as the twitter._FileCache.
+        It may also provide GetWithTime, see twitter.MemoryCache.
     '''
     if cache == DEFAULT_CACHE:
-      self._cache = _FileCache()
+      if sqlite3 is None:
+        self._cache = _FileCache()
+      else:
+        self._cache = TieredCache()
     else:
       self._cache = cache
 
-  def SetUrllib(self, urllib):
-    '''Override the default urllib implementation.
+  def SetHttp(self, http):
+    '''Override the connection pool used to make HTTP requests.
+
+    Each Api instance keeps its own httplib2.Http, which pools up to
+    Api.DEFAULT_MAX_CONNECTIONS keep-alive connections per host, so
+    consecutive calls reuse the same TCP connections and TLS sessions
+    and concurrent calls from several threads each get their own.
 
     Args:
-      urllib:
-        An instance that supports the same API as the urllib2 module
+      http:
+        An instance that supports the same API as httplib2.Http.
+        Use None to create a new httplib2.Http.
+    '''
+    if http is None:
+      pool = httplib2.ConnectionPool(max_connections=Api.DEFAULT_MAX_CONNECTIONS)
+      self._http = httplib2.Http(connections=pool)
+    else:
+      self._http = http
+
+  def SetUrllib(self, urllib):
+    '''Deprecated, requests are made with httplib2 and urllib is unused.
+
+    Use SetHttp to replace the HTTP client instead.
     '''
-    self._urllib = urllib
+    warnings.warn('SetUrllib has no effect, use SetHttp instead',
+                  DeprecationWarning, stacklevel=2)
 
   def SetCacheTimeout(self, cache_timeout):
     '''Override the default cache timeout.
@@ -3297,6 +3789,25 @@ class Api(object):
     '''
     self._cache_timeout = cache_timeout
 
+  def SetMaxRetries(self, max_retries, retry_deadline=None):
+    '''Override the number of times a GET is retried.
+
+    Only transient failures are retried: 5xx responses, timeouts and
+    dropped connections.  Use 0 to disable retries.
+
+    Args:
+      max_retries:
+        The number of retries after the first attempt.
+      retry_deadline:
+        The number of seconds after the first attempt past which no
+        retry is started.  Keep it below the deadline of the request
+        serving the call, 30 seconds on App Engine.
+        Defaults to Api.RETRY_DEADLINE. [Optional]
+    '''
+    self._max_retries = max_retries
+    if retry_deadline is not None:
+      self._retry_deadline = retry_deadline
+
   def SetUserAgent(self, user_agent):
     '''Override the default user agent
 
@@ -3414,21 +3925,12 @@ class Api(object):
       self._request_headers = {}
 
   def _InitializeUserAgent(self):
-    user_agent = 'Python-urllib/%s (python-twitter/%s)' % \
-                 (self._urllib.__version__, __version__)
+    user_agent = 'Python-httplib2 (python-twitter/%s)' % __version__
     self.SetUserAgent(user_agent)
 
   def _InitializeDefaultParameters(self):
     self._default_params = {}
 
-  def _DecompressGzippedResponse(self, response):
-    raw_data = response.read()
-    if response.headers.get('content-encoding', None) == 'gzip':
-      url_data = gzip.GzipFile(fileobj=StringIO.StringIO(raw_data)).read()
-    else:
-      url_data = raw_data
-    return url_data
-
   def _Encode(self, s):
     if self._input_encoding:
       return unicode(s, self._input_encoding).encode('utf-8')
@@ -3472,6 +3974,49 @@ class Api(object):
     else:
       return urllib.urlencode(dict([(k, self._Encode(v)) for k, v in post_data.items()]))
 
+  def _ParseStatuses(self, json):
+    '''Build a list of twitter.Status instances from a JSON array.
+
+    Where the bundled simplejson is available the array is decoded one
+    element at a time, so each Status is created as soon as its element
+    is parsed and keeps the element's original text as its raw_json.
+    Given a streamed body only the part being decoded is held in memory.
+
+    Args:
+      json:
+        The JSON response body, an array of statuses, as a string or as
+        a file-like object from _FetchUrl(stream=True)
+
+    Returns:
+      A list of twitter.Status instances
+
+    Raises:
+      TwitterError wrapping the twitter error message if one exists.
+    '''
+    if hasattr(json, 'read'):
+      try:
+        try:
+          if _raw_iterdecode is not None:
+            return [Status.NewFromJsonDict(x, raw_json=raw)
+                    for x, raw in _raw_iterdecode(json)]
+          data = simplejson.load(json)
+        except ValueError, e:
+          # Error responses never get here, _FetchUrl raises for them
+          raise TwitterError('Malformed response: %s' % e)
+      finally:
+        json.close()
+    else:
+      if _raw_iterdecode is not None:
+        try:
+          return [Status.NewFromJsonDict(x, raw_json=raw)
+                  for x, raw in _raw_iterdecode(json)]
+        except ValueError:
+          # Not an array, most likely a twitter error message
+          pass
+      data = simplejson.loads(json)
+    self._CheckForTwitterError(data)
+    return [Status.NewFromJsonDict(x) for x in data]
+
   def _CheckForTwitterError(self, data):
     """Raises a TwitterError if twitter returns an error message.
 
@@ -3487,12 +4032,40 @@ class Api(object):
     if 'error' in data:
       raise TwitterError(data['error'])
 
+  def _CheckResponse(self, response, content):
+    '''Raises a TwitterError if the response is not a success.
+
+    Args:
+      response:
+        The httplib2.Response of the request
+      content:
+        The response body
+
+    Raises:
+      TwitterError wrapping the twitter error message if one exists, or
+      the HTTP status otherwise.
+    '''
+    if response.status < 300:
+      return
+    try:
+      data = simplejson.loads(content)
+    except ValueError:
+      data = None
+    if isinstance(data, dict) and 'error' in data:
+      message = data['error']
+    else:
+      message = 'HTTP Error %d: %s' % (response.status, response.reason)
+    if response.status == httplib.UNAUTHORIZED:
+      raise _UnauthorizedError(message)
+    raise TwitterError(message)
+
   def _FetchUrl(self,
                 url,
                 post_data=None,
                 parameters=None,
                 no_cache=None,
-                use_gzip_compression=None):
+                use_gzip_compression=None,
+                stream=False):
     '''Fetch a URL, optionally caching for a specified time.
 
     Args:
@@ -3511,9 +4084,15 @@ class Api(object):
         It does not apply to POST requests.
         Defaults to None, which will get the value to use from
         the instance variable self._use_gzip [Optional]
+      stream:
+        If True, a GET that is not answered from the cache returns a
+        file-like object reading the body off the connection, and caches
+        it once read to the end.  Close it if it is not read to the end.
+        [Optional]
 
     Returns:
-      A string containing the body of the response.
+      A string containing the body of the response, or a file-like
+      object with read and close methods if stream is True.
     '''
     # Build the extra parameters dict
     extra_params = {}
@@ -3528,25 +4107,24 @@ class Api(object):
       http_method = "GET"
 
     if self._debugHTTP:
-      _debug = 1
-    else:
-      _debug = 0
+      httplib2.debuglevel = 1
 
-    http_handler  = self._urllib.HTTPHandler(debuglevel=_debug)
-    https_handler = self._urllib.HTTPSHandler(debuglevel=_debug)
-
-    opener = self._urllib.OpenerDirector()
-    opener.add_handler(http_handler)
-    opener.add_handler(https_handler)
+    headers = self._request_headers.copy()
 
     if use_gzip_compression is None:
       use_gzip = self._use_gzip
     else:
       use_gzip = use_gzip_compression
 
-    # Set up compression
+    # Set up compression, httplib2 asks for gzip on every GET unless told
+    # otherwise and decompresses the response as it is read
     if use_gzip and not post_data:
-      opener.addheaders.append(('Accept-Encoding', 'gzip'))
+      headers['Accept-Encoding'] = 'gzip'
+    else:
+      headers['Accept-Encoding'] = 'identity'
+
+    # The signed URL changes with every request, so cache by the unsigned one
+    cache_url = self._BuildUrl(url, extra_params=extra_params)
 
     if self._oauth_consumer is not None:
       if post_data and http_method == "POST":
@@ -3559,8 +4137,6 @@ class Api(object):
 
       req.sign_request(self._signature_method_hmac_sha1, self._oauth_consumer, self._oauth_token)
 
-      headers = req.to_header()
-
       if http_method == "POST":
         encoded_post_data = req.to_postdata()
       else:
@@ -3570,36 +4146,624 @@ class Api(object):
       url = self._BuildUrl(url, extra_params=extra_params)
       encoded_post_data = self._EncodePostData(post_data)
 
+    if encoded_post_data:
+      headers['Content-Type'] = 'application/x-www-form-urlencoded'
+
+    # Unique keys are a combination of the url, the oAuth Consumer Key and
+    # the access token, as the response may depend on who is asking
+    if self._consumer_key:
+      key = '%s:%s:%s' % (self._consumer_key, self._access_token_key or '',
+                          cache_url)
+    else:
+      key = cache_url
+
+    if encoded_post_data:
+      response, url_data = self._Request(url, http_method,
+                                         body=encoded_post_data,
+                                         headers=headers)
+      self._CheckResponse(response, url_data)
+      return url_data
+
+    # Identical GETs already in flight, from any Api instance, share the
+    # one upstream request.  The cache key already tells askers apart.
+    # A streamed body goes to the first caller, the others get it once it
+    # has been read.
+    flight_key = '%s:%s' % (no_cache, key)
+    return Api._in_flight.Do(flight_key, self._GetUrl, url, http_method,
+                             key, headers, no_cache, stream)
+
+  def _GetUrl(self, url, http_method, key, headers, no_cache, stream=False):
+    '''Fetch the body of a GET request, going through the cache.
+
+    Args:
+      url:
+        The URL to retrieve
+      http_method:
+        The HTTP method of the request
+      key:
+        The cache key of the URL
+      headers:
+        The request headers
+      no_cache:
+        If true, overrides the cache on the current request
+      stream:
+        If true, return a body that is not cached as a file-like object
+        [Optional]
+
+    Returns:
+      A string containing the body of the response, or a file-like
+      object if stream is true and the body was not cached.
+    '''
     # Open and return the URL immediately if we're not going to cache
-    if encoded_post_data or no_cache or not self._cache or not self._cache_timeout:
-      response = opener.open(url, encoded_post_data)
-      url_data = self._DecompressGzippedResponse(response)
-      opener.close()
+    if no_cache or not self._cache or not self._cache_timeout:
+      response, url_data = self._Request(url, http_method, headers=headers,
+                                         stream=stream)
+      if stream and response.status < 300:
+        return _StreamReader(url_data)
+      if stream:
+        url_data = url_data.read()
+      self._CheckResponse(response, url_data)
     else:
-      # Unique keys are a combination of the url and the oAuth Consumer Key
-      if self._consumer_key:
-        key = self._consumer_key + ':' + url
+      # See if it has been cached before, caches that can return the data
+      # and its time together save a second lookup
+      if hasattr(self._cache, 'GetWithTime'):
+        url_data, last_cached = self._cache.GetWithTime(key) or (None, None)
       else:
-        key = url
-
-      # See if it has been cached before
-      last_cached = self._cache.GetCachedTime(key)
+        url_data, last_cached = None, self._cache.GetCachedTime(key)
 
-      # If the cached version is outdated then fetch another and store it
+      # If the cached version is outdated then revalidate it, or fetch
+      # another, and store it
       if not last_cached or time.time() >= last_cached + self._cache_timeout:
-        try:
-          response = opener.open(url, encoded_post_data)
-          url_data = self._DecompressGzippedResponse(response)
-          self._cache.Set(key, url_data)
-        except urllib2.HTTPError, e:
-          print e
-        opener.close()
-      else:
+        if last_cached and url_data is None:
+          url_data = self._cache.Get(key)
+        url_data = self._RevalidateUrl(url, http_method, key, url_data,
+                                       headers, stream)
+      elif url_data is None:
         url_data = self._cache.Get(key)
 
     # Always return the latest version
     return url_data
 
+  def _Request(self, url, http_method, body=None, headers=None, stream=False):
+    '''Make an HTTP request, retrying transient failures of GETs.
+
+    Timeouts, dropped connections, failed DNS lookups and 5xx responses
+    are transient.  Retries wait an exponentially growing, randomly
+    jittered time, or what the Retry-After header asks for.  Every host
+    has a circuit breaker shared by all Api instances: after CIRCUIT_FAILURES
+    consecutive failures, requests to it fail straight away for
+    CIRCUIT_COOLDOWN seconds, and then a single request is let through
+    to probe it.  No retry is started past the retry deadline, so a call
+    fits in the deadline of the request serving it.  POSTs are not
+    retried as they may not be idempotent.
+
+    Args:
+      url:
+        The URL to retrieve
+      http_method:
+        The HTTP method of the request
+      body:
+        The encoded request body [Optional]
+      headers:
+        The request headers [Optional]
+      stream:
+        If True, content is an httplib2.ResponseStream [Optional]
+
+    Returns:
+      A (response, content) tuple, as from httplib2.Http.request.
+      If the retries run out on a transient error response it is
+      returned as is.
+    '''
+    if stream:
+      kwargs = {'stream': True}
+    else:
+      kwargs = {}
+    circuit = self._GetCircuit(url)
+    if http_method == 'GET':
+      retries = self._max_retries
+    else:
+      retries = 0
+
+    attempt = 0
+    deadline = time.time() + self._retry_deadline
+    while True:
+      if not circuit.Allow():
+        raise TwitterError('Too many failures from %s, retry later' % circuit.host)
+      delay = None
+      try:
+        response, content = self._http.request(url, http_method,
+                                               body=body, headers=headers,
+                                               **kwargs)
+      except Api.TRANSIENT_ERRORS:
+        circuit.Failure()
+        if attempt >= retries:
+          raise
+        error = sys.exc_info()
+      except:
+        # Not the host's fault, but a trial call must still be settled
+        circuit.Release()
+        raise
+      else:
+        if response.status not in Api.TRANSIENT_STATUSES:
+          circuit.Success()
+          return response, content
+        circuit.Failure()
+        if attempt >= retries:
+          return response, content
+        error = None
+        try:
+          delay = min(float(response['retry-after']), Api.RETRY_BACKOFF_CAP)
+        except (KeyError, ValueError):
+          pass
+
+      if delay is None:
+        delay = random.uniform(0, min(Api.RETRY_BACKOFF_CAP,
+                                      Api.RETRY_BACKOFF * 2 ** attempt))
+      if time.time() + delay > deadline:
+        # No time left for another attempt, give up as if out of retries
+        if error:
+          raise error[0], error[1], error[2]
+        return response, content
+      if stream and not error:
+        content.close()
+      attempt += 1
+      time.sleep(delay)
+
+  def _GetCircuit(self, url):
+    '''Return the circuit breaker for the host of url.'''
+    host = urlparse.urlparse(url)[1]
+    Api._circuits_lock.acquire()
+    try:
+      circuit = Api._circuits.get(host)
+      if circuit is None:
+        circuit = Api._circuits[host] = _CircuitBreaker(host,
+                                                        Api.CIRCUIT_FAILURES,
+                                                        Api.CIRCUIT_COOLDOWN)
+      return circuit
+    finally:
+      Api._circuits_lock.release()
+
+  def _RevalidateUrl(self, url, http_method, key, cached_data, headers,
+                     stream=False):
+    '''Fetch a URL whose cached copy has expired, storing the result.
+
+    The ETag and Last-Modified validators of the last response are kept
+    in the cache next to it and sent back as If-None-Match and
+    If-Modified-Since.  A 304 Not Modified only refreshes the time of
+    the cached copy.  Only a 200 OK is cached.  A transient error
+    returns the expired copy as is, other errors raise TwitterError.
+
+    Args:
+      url:
+        The URL to retrieve
+      http_method:
+        The HTTP method of the request
+      key:
+        The cache key of the URL
+      cached_data:
+        The expired copy of the response body, or None
+      headers:
+        The request headers
+      stream:
+        If true, return a new body as a file-like object and cache it
+        once it has been read to the end [Optional]
+
+    Returns:
+      A string containing the body of the response, or a file-like
+      object if stream is true and a new body was received.
+    '''
+    validators_key = key + ':validators'
+    if cached_data is not None:
+      validators = self._cache.Get(validators_key)
+      if validators:
+        etag, last_modified = validators.split('\n', 1)
+        if etag:
+          headers['If-None-Match'] = etag
+        if last_modified:
+          headers['If-Modified-Since'] = last_modified
+
+    response, url_data = self._Request(url, http_method, headers=headers,
+                                       stream=stream)
+
+    if response.status == 304 and cached_data is not None:
+      if stream:
+        url_data.close()
+      self._cache.Set(key, cached_data)
+      return cached_data
+
+    if response.status != 200:
+      if stream:
+        url_data = url_data.read()
+      # Never cache an error.  Ride out a transient one on the expired
+      # copy, but a client error means the copy no longer applies.
+      if response.status in Api.TRANSIENT_STATUSES and cached_data is not None:
+        return cached_data
+      if cached_data is not None:
+        self._cache.Remove(key)
+        self._cache.Remove(validators_key)
+      self._CheckResponse(response, url_data)
+      return url_data
+
+    if 'etag' in response or 'last-modified' in response:
+      self._cache.Set(validators_key, '%s\n%s' % (response.get('etag', ''),
+                                                  response.get('last-modified', '')))
+    else:
+      self._cache.Remove(validators_key)
+
+    if stream:
+      def store(content):
+        if content is not None:
+          self._cache.Set(key, content)
+      reader = _StreamReader(url_data)
+      reader.OnBody(store)
+      return reader
+
+    self._cache.Set(key, url_data)
+    return url_data
+
+class ApiFuture(object):
+  '''The pending result of a twitter.AsyncApi call.'''
+
+  def __init__(self):
+    self._done      = threading.Event()
+    self._lock      = threading.Lock()
+    self._callbacks = []
+    self._result    = None
+    self._error     = None
+
+  def Done(self):
+    '''Return True once the call has finished.'''
+    return self._done.isSet()
+
+  def Result(self, timeout=None):
+    '''Wait for the call to finish, returning its result or re-raising.
+
+    Args:
+      timeout:
+        The longest time to wait, in seconds.  Defaults to waiting
+        for as long as it takes. [Optional]
+
+    Returns:
+      What the twitter.Api method returned.
+    '''
+    self._done.wait(timeout)
+    if not self._done.isSet():
+      raise TwitterError('Timed out waiting for the Twitter API')
+    if self._error:
+      raise self._error[0], self._error[1], self._error[2]
+    return self._result
+
+  def AddDoneCallback(self, callback):
+    '''Call callback(future) once the call has finished.
+
+    The callback runs on the worker thread that made the call, or right
+    away if the call has already finished.
+    '''
+    self._lock.acquire()
+    try:
+      if not self._done.isSet():
+        self._callbacks.append(callback)
+        return
+    finally:
+      self._lock.release()
+    callback(self)
+
+  def _Finish(self, result, error):
+    self._lock.acquire()
+    try:
+      self._result = result
+      self._error  = error
+      self._done.set()
+      callbacks, self._callbacks = self._callbacks, []
+    finally:
+      self._lock.release()
+    for callback in callbacks:
+      callback(self)
+
+class AsyncApi(object):
+  '''A non-blocking twitter interface.
+
+  Every call returns a twitter.ApiFuture straight away and is made on
+  a pool of worker threads sharing the connection pool of the
+  twitter.Api, so up to max_workers requests are in flight at once.
+  Parsing, OAuth signing and the cache are those of the twitter.Api it
+  wraps.
+
+  Example usage:
+
+    To fetch many timelines at once:
+
+      >>> api = twitter.AsyncApi(twitter.Api(consumer_key='consumer_key',
+            consumer_secret='consumer_secret', access_token_key='access_token',
+            access_token_secret='access_token_secret'), max_workers=32)
+      >>> futures = [api.GetUserTimeline(user) for user in users]
+      >>> for future in futures:
+      >>>   print [s.text for s in future.Result()]
+      >>> api.Close()
+  '''
+
+  def __init__(self, api=None, max_workers=None):
+    '''Instantiate a new twitter.AsyncApi object.
+
+    Args:
+      api:
+        The twitter.Api to make the calls with.  Defaults to a new
+        twitter.Api with no credentials. [Optional]
+      max_workers:
+        The maximum number of calls in flight at once.
+        Defaults to Api.DEFAULT_MAX_WORKERS. [Optional]
+    '''
+    if api is None:
+      api = Api()
+    if max_workers is None:
+      max_workers = Api.DEFAULT_MAX_WORKERS
+    self._api     = api
+    self._calls   = Queue.Queue()
+    self._workers = [threading.Thread(target=self._Work)
+                     for i in range(max_workers)]
+    for worker in self._workers:
+      worker.setDaemon(True)
+      worker.start()
+
+  def Submit(self, method, *args, **kwargs):
+    '''Call any twitter.Api method without blocking.
+
+    Args:
+      method:
+        The name of the twitter.Api method, such as 'GetFriends'.
+      *args, **kwargs:
+        The arguments of the method.
+
+    Returns:
+      A twitter.ApiFuture for the value the method returns.
+    '''
+    future = ApiFuture()
+    self._calls.put((future, method, args, kwargs))
+    return future
+
+  def GetUserTimeline(self, *args, **kwargs):
+    '''See twitter.Api.GetUserTimeline, returns a twitter.ApiFuture.'''
+    return self.Submit('GetUserTimeline', *args, **kwargs)
+
+  def GetStatus(self, *args, **kwargs):
+    '''See twitter.Api.GetStatus, returns a twitter.ApiFuture.'''
+    return self.Submit('GetStatus', *args, **kwargs)
+
+  def StatusesLookup(self, *args, **kwargs):
+    '''See twitter.Api.StatusesLookup, returns a twitter.ApiFuture.'''
+    return self.Submit('StatusesLookup', *args, **kwargs)
+
+  def GetUser(self, *args, **kwargs):
+    '''See twitter.Api.GetUser, returns a twitter.ApiFuture.'''
+    return self.Submit('GetUser', *args, **kwargs)
+
+  def UsersLookup(self, *args, **kwargs):
+    '''See twitter.Api.UsersLookup, returns a twitter.ApiFuture.'''
+    return self.Submit('UsersLookup', *args, **kwargs)
+
+  def GetFollowerIDs(self, *args, **kwargs):
+    '''See twitter.Api.GetFollowerIDs, returns a twitter.ApiFuture.'''
+    return self.Submit('GetFollowerIDs', *args, **kwargs)
+
+  def GetFriendIDs(self, *args, **kwargs):
+    '''See twitter.Api.GetFriendIDs, returns a twitter.ApiFuture.'''
+    return self.Submit('GetFriendIDs', *args, **kwargs)
+
+  def Close(self):
+    '''Finish the calls already submitted and stop the workers.'''
+    for worker in self._workers:
+      self._calls.put(None)
+    for worker in self._workers:
+      worker.join()
+    self._workers = []
+
+  def _Work(self):
+    api = self._api
+    while True:
+      call = self._calls.get()
+      if call is None:
+        return
+      future, method, args, kwargs = call
+      try:
+        result = getattr(api, method)(*args, **kwargs)
+      except:
+        future._Finish(None, sys.exc_info())
+      else:
+        future._Finish(result, None)
+
+class _StreamReader(object):
+  '''A file-like read() over the chunks of an httplib2.ResponseStream.'''
+
+  def __init__(self, stream):
+    self._stream    = stream
+    self._chunks    = None
+    self._callbacks = []
+
+  def read(self, size=-1):
+    '''Return the next chunk of the body, or all of it if size is -1.
+
+    Chunks are handed back as they arrive, so one may be shorter or
+    longer than size.  An empty string marks the end of the body.
+    '''
+    if size == 0:
+      return ''
+    if size < 0:
+      data = ''.join(list(self._stream))
+    else:
+      data = ''
+      for data in self._stream:
+        break
+    if self._chunks is not None:
+      self._chunks.append(data)
+    if size < 0 or not data:
+      self._Finish(True)
+    return data
+
+  def close(self):
+    '''Stop reading, giving the connection back.'''
+    self._stream.close()
+    self._Finish(False)
+
+  def OnBody(self, callback):
+    '''Call callback(body) once the body has been read to the end, or
+    callback(None) if it is closed before that.'''
+    if self._chunks is None:
+      self._chunks = []
+    self._callbacks.append(callback)
+
+  def _Finish(self, complete):
+    callbacks, self._callbacks = self._callbacks, []
+    if complete and self._chunks is not None:
+      body = ''.join(self._chunks)
+    else:
+      body = None
+    self._chunks = None
+    for callback in callbacks:
+      callback(body)
+
+class _BackgroundCall(threading.Thread):
+  '''Call a function on a daemon thread and hand back its result later.'''
+
+  def __init__(self, function, *args, **kwargs):
+    threading.Thread.__init__(self)
+    self.setDaemon(True)
+    self._function = function
+    self._args     = args
+    self._kwargs   = kwargs
+    self._result   = None
+    self._error    = None
+    self.start()
+
+  def run(self):
+    try:
+      self._result = self._function(*self._args, **self._kwargs)
+    except:
+      self._error = sys.exc_info()
+
+  def Get(self):
+    '''Wait for the call to finish, returning its result or re-raising.'''
+    self.join()
+    if self._error:
+      raise self._error[0], self._error[1], self._error[2]
+    return self._result
+
+class _SingleFlight(object):
+  '''Collapse concurrent identical calls into a single one.
+
+  The first caller for a key runs the function, later callers for the
+  same key block until it is done and get the same result or exception.
+  A result with an OnBody method, a streamed body, goes to the first
+  caller only.  The others get the whole body once it has been read, or
+  make the call themselves if it was closed early.
+  '''
+
+  def __init__(self):
+    self._lock    = threading.Lock()
+    self._flights = {}
+
+  def Do(self, key, function, *args, **kwargs):
+    '''Call function, or wait for the call already running for key.'''
+    self._lock.acquire()
+    try:
+      flight = self._flights.get(key)
+      leader = flight is None
+      if leader:
+        flight = self._flights[key] = [threading.Event(), None, None, False]
+    finally:
+      self._lock.release()
+
+    if leader:
+      try:
+        result = function(*args, **kwargs)
+      except:
+        self._Land(key, flight, None, sys.exc_info())
+        raise
+      if hasattr(result, 'OnBody'):
+        result.OnBody(lambda body: self._Land(key, flight, body,
+                                              missed=body is None))
+      else:
+        self._Land(key, flight, result)
+      return result
+
+    flight[0].wait()
+    if flight[2]:
+      raise flight[2][0], flight[2][1], flight[2][2]
+    if flight[3]:
+      # The leader's body was closed early, there is nothing to share
+      return function(*args, **kwargs)
+    return flight[1]
+
+  def _Land(self, key, flight, result, error=None, missed=False):
+    self._lock.acquire()
+    try:
+      del self._flights[key]
+    finally:
+      self._lock.release()
+    flight[1] = result
+    flight[2] = error
+    flight[3] = missed
+    flight[0].set()
+
+Api._in_flight = _SingleFlight()
+
+class _CircuitBreaker(object):
+  '''Stop calling a host that keeps failing.
+
+  The circuit opens after a run of consecutive failures.  Once the
+  cooldown has passed a single trial call is allowed: if it succeeds
+  the circuit closes again, if it fails the cooldown starts over.
+  '''
+
+  def __init__(self, host, failures, cooldown):
+    self.host       = host
+    self._failures  = failures
+    self._cooldown  = cooldown
+    self._lock      = threading.Lock()
+    self._count     = 0
+    self._opened_at = None
+    self._trial     = False
+
+  def Allow(self):
+    '''Return True if a call may be made now.'''
+    self._lock.acquire()
+    try:
+      if self._opened_at is None:
+        return True
+      if self._trial or time.time() < self._opened_at + self._cooldown:
+        return False
+      self._trial = True
+      return True
+    finally:
+      self._lock.release()
+
+  def Success(self):
+    self._lock.acquire()
+    try:
+      self._count     = 0
+      self._opened_at = None
+      self._trial     = False
+    finally:
+      self._lock.release()
+
+  def Failure(self):
+    self._lock.acquire()
+    try:
+      self._count += 1
+      if self._trial or self._count >= self._failures:
+        self._opened_at = time.time()
+        self._trial     = False
+    finally:
+      self._lock.release()
+
+  def Release(self):
+    '''End a call that neither succeeded nor failed, letting a new trial
+    call through if this one was it.'''
+    self._lock.acquire()
+    try:
+      self._trial = False
+    finally:
+      self._lock.release()
+
 class _FileCacheError(Exception):
   '''Base exception class for FileCache related errors'''
 
@@ -3652,18 +4816,10 @@ class _FileCache(object):
 
   def _GetUsername(self):
     '''Attempt to find the username in a cross-platform fashion.'''
-    try:
-      return os.getenv('USER') or \
-             os.getenv('LOGNAME') or \
-             os.getenv('USERNAME') or \
-             'nobody'
-    except (IOError, OSError), e:
-      return 'nobody'
+    return _GetUsername()
 
   def _GetTmpCachePath(self):
-    username = self._GetUsername()
-    cache_directory = 'python.cache_' + username
-    return os.path.join(tempfile.gettempdir(), cache_directory)
+    return _GetTmpCachePath()
 
   def _InitializeRootDirectory(self, root_directory):
     if not root_directory:
@@ -3688,3 +4844,384 @@ class _FileCache(object):
 
   def _GetPrefix(self,hashed_key):
     return os.path.sep.join(hashed_key[0:_FileCache.DEPTH])
+
+
+def _GetUsername():
+  '''Attempt to find the username in a cross-platform fashion.'''
+  try:
+    return os.getenv('USER') or \
+           os.getenv('LOGNAME') or \
+           os.getenv('USERNAME') or \
+           'nobody'
+  except (IOError, OSError), e:
+    return 'nobody'
+
+def _GetTmpCachePath():
+  cache_directory = 'python.cache_' + _GetUsername()
+  return os.path.join(tempfile.gettempdir(), cache_directory)
+
+
+class MemoryCache(object):
+  '''An in-process cache that drops its least recently used entries.
+
+  Supports the same API as twitter._FileCache, plus GetWithTime, which
+  returns an entry's data and the time it was cached in one lookup.
+  Safe to share between threads.
+  '''
+
+  DEFAULT_MAX_ENTRIES = 1000
+
+  def __init__(self, max_entries=None, timeout=None):
+    '''Instantiate a new twitter.MemoryCache object.
+
+    Args:
+      max_entries:
+        The number of entries to keep before dropping the least recently
+        used.  Defaults to MemoryCache.DEFAULT_MAX_ENTRIES. [Optional]
+      timeout:
+        Drop entries cached more than this many seconds ago.  Defaults to
+        None, which keeps entries until they are pushed out. [Optional]
+    '''
+    self._max_entries = max_entries or MemoryCache.DEFAULT_MAX_ENTRIES
+    self._timeout = timeout
+    self._lock = threading.Lock()
+    self._entries = {}
+    # A circular doubly linked list of [previous, next, key, data, time],
+    # most recently used first
+    self._root = []
+    self._root[:] = [self._root, self._root, None, None, None]
+
+  def GetWithTime(self, key):
+    self._lock.acquire()
+    try:
+      link = self._entries.get(key)
+      if link is None:
+        return None
+      if self._timeout and time.time() >= link[4] + self._timeout:
+        self._Unlink(key)
+        return None
+      self._Unlink(key)
+      self._Link(link)
+      return link[3], link[4]
+    finally:
+      self._lock.release()
+
+  def Get(self, key):
+    entry = self.GetWithTime(key)
+    if entry is None:
+      return None
+    return entry[0]
+
+  def Set(self, key, data, cached_time=None):
+    if cached_time is None:
+      cached_time = time.time()
+    self._lock.acquire()
+    try:
+      if key in self._entries:
+        self._Unlink(key)
+      self._Link([None, None, key, data, cached_time])
+      while len(self._entries) > self._max_entries:
+        self._Unlink(self._root[0][2])
+    finally:
+      self._lock.release()
+
+  def Remove(self, key):
+    self._lock.acquire()
+    try:
+      if key in self._entries:
+        self._Unlink(key)
+    finally:
+      self._lock.release()
+
+  def GetCachedTime(self, key):
+    entry = self.GetWithTime(key)
+    if entry is None:
+      return None
+    return entry[1]
+
+  def _Link(self, link):
+    first = self._root[1]
+    link[0], link[1] = self._root, first
+    first[0] = self._root[1] = link
+    self._entries[link[2]] = link
+
+  def _Unlink(self, key):
+    link = self._entries.pop(key)
+    link[0][1], link[1][0] = link[1], link[0]
+
+
+class SqliteCache(object):
+  '''A cache kept in a single SQLite file and capped at a number of bytes.
+
+  Once the cached data grows past the cap the least recently used
+  entries are dropped.  The running total of cached bytes is kept in the
+  file next to the data, and read hits are noted in memory and written
+  out in batches, so neither reads nor writes scan the whole table.
+  Supports the same API as twitter.MemoryCache.
+  '''
+
+  DEFAULT_MAX_BYTES = 50 * 1024 * 1024
+  MAX_PENDING_USED  = 500  # read hits held back before they are written
+
+  def __init__(self, path=None, max_bytes=None):
+    '''Instantiate a new twitter.SqliteCache object.
+
+    Args:
+      path:
+        The SQLite file to use.  Defaults to a file in the system's
+        temporary directory. [Optional]
+      max_bytes:
+        The most data to keep, in bytes.  Defaults to
+        SqliteCache.DEFAULT_MAX_BYTES. [Optional]
+    '''
+    if sqlite3 is None:
+      raise _FileCacheError('SqliteCache requires the sqlite3 module')
+    if not path:
+      path = _GetTmpCachePath() + '.sqlite'
+    self._max_bytes = max_bytes or SqliteCache.DEFAULT_MAX_BYTES
+    self._lock = threading.Lock()
+    self._db = sqlite3.connect(path, check_same_thread=False,
+                               isolation_level=None)
+    self._db.execute('CREATE TABLE IF NOT EXISTS cache ('
+                     'key TEXT PRIMARY KEY, data BLOB, cached REAL, '
+                     'used REAL, size INTEGER)')
+    self._db.execute('CREATE INDEX IF NOT EXISTS cache_used ON cache (used)')
+    self._db.execute('CREATE TABLE IF NOT EXISTS cache_size (bytes INTEGER)')
+    self._pending_used = {}
+    self._Begin()
+    try:
+      # Files from before cache_size existed are measured once, here
+      if self._db.execute('SELECT 1 FROM cache_size').fetchone() is None:
+        self._db.execute('INSERT INTO cache_size SELECT IFNULL(SUM(size), 0) '
+                         'FROM cache')
+    except:
+      self._db.execute('ROLLBACK')
+      raise
+    self._db.execute('COMMIT')
+
+  def GetWithTime(self, key):
+    self._lock.acquire()
+    try:
+      row = self._db.execute('SELECT data, cached FROM cache WHERE key = ?',
+                             (key,)).fetchone()
+      if row is None:
+        return None
+      self._pending_used[key] = time.time()
+      if len(self._pending_used) >= SqliteCache.MAX_PENDING_USED:
+        self._Begin()
+        try:
+          self._WriteUsed()
+        except:
+          self._db.execute('ROLLBACK')
+          raise
+        self._db.execute('COMMIT')
+      return str(row[0]), row[1]
+    finally:
+      self._lock.release()
+
+  def Get(self, key):
+    entry = self.GetWithTime(key)
+    if entry is None:
+      return None
+    return entry[0]
+
+  def Set(self, key, data, cached_time=None):
+    now = time.time()
+    if cached_time is None:
+      cached_time = now
+    self._lock.acquire()
+    try:
+      self._Begin()
+      try:
+        # Eviction goes by the used times, so bring them up to date first
+        self._pending_used.pop(key, None)
+        self._WriteUsed()
+        size = len(data) - self._Delete(key)
+        self._db.execute('INSERT INTO cache VALUES (?, ?, ?, ?, ?)',
+                         (key, sqlite3.Binary(data), cached_time, now,
+                          len(data)))
+        self._db.execute('UPDATE cache_size SET bytes = bytes + ?', (size,))
+        size = self._db.execute('SELECT bytes FROM cache_size').fetchone()[0]
+        if size > self._max_bytes:
+          rows = self._db.execute('SELECT key, size FROM cache ORDER BY used')
+          stale = []
+          for stale_key, stale_size in rows:
+            if size <= self._max_bytes:
+              break
+            stale.append((stale_key,))
+            size -= stale_size
+          self._db.executemany('DELETE FROM cache WHERE key = ?', stale)
+          self._db.execute('UPDATE cache_size SET bytes = ?', (size,))
+      except:
+        self._db.execute('ROLLBACK')
+        raise
+      self._db.execute('COMMIT')
+    finally:
+      self._lock.release()
+
+  def Remove(self, key):
+    self._lock.acquire()
+    try:
+      self._pending_used.pop(key, None)
+      self._Begin()
+      try:
+        size = self._Delete(key)
+        if size:
+          self._db.execute('UPDATE cache_size SET bytes = bytes - ?', (size,))
+      except:
+        self._db.execute('ROLLBACK')
+        raise
+      self._db.execute('COMMIT')
+    finally:
+      self._lock.release()
+
+  def GetCachedTime(self, key):
+    self._lock.acquire()
+    try:
+      row = self._db.execute('SELECT cached FROM cache WHERE key = ?',
+                             (key,)).fetchone()
+    finally:
+      self._lock.release()
+    if row is None:
+      return None
+    return row[0]
+
+  def _Begin(self):
+    # The file may be shared with other processes, so take the write lock
+    # up front and keep cache_size in step with the rows it counts
+    self._db.execute('BEGIN IMMEDIATE')
+
+  def _Delete(self, key):
+    '''Delete key's row, returning the bytes it held.'''
+    row = self._db.execute('SELECT size FROM cache WHERE key = ?',
+                           (key,)).fetchone()
+    if row is None:
+      return 0
+    self._db.execute('DELETE FROM cache WHERE key = ?', (key,))
+    return row[0]
+
+  def _WriteUsed(self):
+    if self._pending_used:
+      self._db.executemany('UPDATE cache SET used = ? WHERE key = ?',
+                           [(used, key) for key, used
+                            in self._pending_used.items()])
+      self._pending_used = {}
+
+
+class TieredCache(object):
+  '''A fast MemoryCache in front of a larger, slower cache.
+
+  Lookups are served from memory when possible and fall back to the
+  second tier, copying what they find into memory.  Writes go to both.
+  '''
+
+  def __init__(self, memory=None, store=None):
+    '''Instantiate a new twitter.TieredCache object.
+
+    Args:
+      memory:
+        The first tier.  Defaults to a MemoryCache keeping entries for
+        five minutes. [Optional]
+      store:
+        The second tier, a cache supporting the same API as
+        twitter.MemoryCache.  Defaults to a SqliteCache. [Optional]
+    '''
+    if memory is None:
+      memory = MemoryCache(timeout=300)
+    if store is None:
+      store = SqliteCache()
+    self._memory = memory
+    self._store = store
+
+  def GetWithTime(self, key):
+    entry = self._memory.GetWithTime(key)
+    if entry is None:
+      entry = self._store.GetWithTime(key)
+      if entry is not None:
+        self._memory.Set(key, entry[0], entry[1])
+    return entry
+
+  def Get(self, key):
+    entry = self.GetWithTime(key)
+    if entry is None:
+      return None
+    return entry[0]
+
+  def Set(self, key, data):
+    cached_time = time.time()
+    self._memory.Set(key, data, cached_time)
+    self._store.Set(key, data, cached_time)
+
+  def Remove(self, key):
+    self._memory.Remove(key)
+    self._store.Remove(key)
+
+  def GetCachedTime(self, key):
+    entry = self.GetWithTime(key)
+    if entry is None:
+      return None
+    return entry[1]
+
+
+class MemcacheCache(object):
+  '''A cache on Google App Engine's memcache, shared by every instance.
+
+  The data and the time it was cached are stored together in a single
+  memcache entry.  Supports the same API as twitter.MemoryCache.
+  '''
+
+  DEFAULT_TIMEOUT = 60 * 60
+  MAX_VALUE_SIZE  = 1000000  # memcache refuses values over 1MB, pickled
+
+  def __init__(self, prefix='twitter:', timeout=None):
+    '''Instantiate a new twitter.MemcacheCache object.
+
+    Args:
+      prefix:
+        Prepended to every memcache key. [Optional]
+      timeout:
+        Seconds before memcache may drop an entry.  Defaults to
+        MemcacheCache.DEFAULT_TIMEOUT. [Optional]
+    '''
+    if memcache is None:
+      raise _FileCacheError('MemcacheCache requires Google App Engine')
+    self._prefix = prefix
+    self._timeout = timeout or MemcacheCache.DEFAULT_TIMEOUT
+
+  def GetWithTime(self, key):
+    entry = memcache.get(self._GetKey(key))
+    if entry is None:
+      return None
+    cached_time, data = entry
+    return data, cached_time
+
+  def Get(self, key):
+    entry = self.GetWithTime(key)
+    if entry is None:
+      return None
+    return entry[0]
+
+  def Set(self, key, data, cached_time=None):
+    # An oversized page is only a cache miss; it mustn't fail the call
+    # that fetched it
+    if len(data) > MemcacheCache.MAX_VALUE_SIZE:
+      return
+    if cached_time is None:
+      cached_time = time.time()
+    try:
+      memcache.set(self._GetKey(key), (cached_time, data), self._timeout)
+    except ValueError:
+      pass
+
+  def Remove(self, key):
+    memcache.delete(self._GetKey(key))
+
+  def GetCachedTime(self, key):
+    entry = self.GetWithTime(key)
+    if entry is None:
+      return None
+    return entry[1]
+
+  def _GetKey(self, key):
+    # Signed URLs easily pass memcache's 250 byte key limit
+    return self._prefix + md5(key).hexdigest()